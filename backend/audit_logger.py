@@ -1,9 +1,12 @@
 import json
 import os
+import threading
 from datetime import datetime
 from typing import Any, Dict
 
 LOG_FILE = os.path.join(os.path.dirname(__file__), "../data/audit_log.json")
+# Queries run concurrently in the threadpool; serialize the read-modify-write below
+_log_lock = threading.Lock()
 
 def log_incident_query(
     username: str, 
@@ -13,7 +16,8 @@ def log_incident_query(
     report: str, 
     sources: list, 
     retrieved_chunks: list = None,
-    model_version: str = "gpt-4o"
+    model_version: str = "gpt-4o",
+    token_usage: dict = None
 ):
     """Logs an incident investigation query and its full RAG context for audit/replay."""
     log_entry = {
@@ -25,26 +29,28 @@ def log_incident_query(
         "report": report,
         "model_version": model_version,
         "sources_referenced": [str(s) for s in sources],
-        "retrieved_chunks": retrieved_chunks or []
+        "retrieved_chunks": retrieved_chunks or [],
+        "token_usage": token_usage or {}
     }
     
-    # Ensure directory exists
-    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
-    
-    # Read existing logs or create new list
-    logs = []
-    if os.path.exists(LOG_FILE):
-        try:
-            with open(LOG_FILE, 'r') as f:
-                logs = json.load(f)
-        except (json.JSONDecodeError, IOError):
-            logs = []
-            
-    logs.append(log_entry)
-    
-    # Write back to file
-    with open(LOG_FILE, 'w') as f:
-        json.dump(logs, f, indent=2)
+    with _log_lock:
+        # Ensure directory exists
+        os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+
+        # Read existing logs or create new list
+        logs = []
+        if os.path.exists(LOG_FILE):
+            try:
+                with open(LOG_FILE, 'r') as f:
+                    logs = json.load(f)
+            except (json.JSONDecodeError, IOError):
+                logs = []
+
+        logs.append(log_entry)
+
+        # Write back to file
+        with open(LOG_FILE, 'w') as f:
+            json.dump(logs, f, indent=2)
 
 def get_audit_logs():
     """Retrieves all audit logs."""
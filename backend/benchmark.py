@@ -0,0 +1,652 @@
+"""
+Offline benchmark suite for the SOC RAGBot backend.
+
+Every hot path runs against the deterministic stand-ins in fake_backends.py,
+so no OpenAI key or running server is needed and results are comparable
+between runs. Results are written as JSON.
+
+Usage (from backend/):
+    python benchmark.py --output bench.json
+    python benchmark.py --only cache,audit --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import traceback
+import statistics
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+from typing import Callable, Dict, List
+
+# The app modules read these at import time; the stand-in backends never use them.
+os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+os.environ.setdefault("JWT_SECRET_KEY", "offline-benchmark-secret")
+os.environ["USE_MOCK_MODE"] = "false"
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import audit_logger
+from agent import IncidentAgent
+from cache_manager import CacheManager
+from fake_backends import FakeChatModel, FakeEmbeddings
+from log_analyzer import LogAnalyzer
+from rag_engine import RAGEngine
+
+KNOWLEDGE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/knowledge"))
+
+SAMPLE_QUERIES = [
+    "Suspected ransomware on file server {i}",
+    "How do we respond to SSH brute force attempts from IP 10.0.{i}.7",
+    "Phishing email reported by finance user {i}",
+    "Malware beacon detected on workstation {i}",
+    "What are the containment steps for incident {i}",
+]
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    ms = [s * 1000 for s in samples]
+    return {
+        "mean_ms": round(statistics.mean(ms), 3),
+        "p50_ms": round(_percentile(ms, 50), 3),
+        "p95_ms": round(_percentile(ms, 95), 3),
+        "p99_ms": round(_percentile(ms, 99), 3),
+        "max_ms": round(max(ms), 3),
+    }
+
+def _timed(fn: Callable, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+@contextmanager
+def _env(**overrides):
+    saved = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+def _write_synthetic_logs(path: str, records: int, seed: int = 7):
+    rng = random.Random(seed)
+    users = ["root", "admin", "ubuntu", "oracle", "test", "git", "postgres"]
+    logs = []
+    for _ in range(records):
+        logs.append({
+            "foreign_ip": f"10.{rng.randint(0, 3)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            "username": rng.choice(users),
+            "passwords": [f"pw{rng.randint(0, 9999)}" for _ in range(rng.randint(1, 6))],
+        })
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(logs, f)
+
+def _build_engine(workdir: str, name: str, embedding_latency: float, chunking: str = "structured") -> RAGEngine:
+    engine = RAGEngine(
+        data_dir=KNOWLEDGE_DIR,
+        persist_dir=os.path.join(workdir, name),
+        embeddings=FakeEmbeddings(latency=embedding_latency),
+        chunking=chunking,
+        snapshot_dir=os.path.join(workdir, f"{name}_snapshot"),
+    )
+    return engine
+
+def _build_agent(workdir: str, args, name: str) -> IncidentAgent:
+    engine = _build_engine(workdir, f"chroma_{name}", args.embedding_latency)
+    engine.ingest_documents()
+    log_path = os.path.join(workdir, f"logs_{name}.json")
+    _write_synthetic_logs(log_path, 2000)
+    return IncidentAgent(
+        llm=FakeChatModel(latency=args.llm_latency),
+        fast_llm=FakeChatModel(latency=args.llm_latency / 4),
+        rag_engine=engine,
+        log_analyzer=LogAnalyzer(log_path=log_path),
+        cache_manager=CacheManager(db_path=os.path.join(workdir, f"{name}_cache.db"), embeddings=FakeEmbeddings(latency=args.embedding_latency)),
+    )
+
+def bench_query(workdir: str, args) -> Dict:
+    """/query throughput and tail latency under concurrent load, through the real ASGI app."""
+    import httpx
+    from auth import create_access_token
+
+    agent = _build_agent(workdir, args, "query")
+    # Import the app without letting it build its own OpenAI-backed agent
+    with _env(USE_MOCK_MODE="true", RATE_LIMIT_STORAGE_URI="memory://"):
+        import main
+    main.agent = agent
+    main.limiter.enabled = False
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+
+    async def run_load():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, statuses = [], {}
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def one(i: int):
+                query = SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)].format(i=i)
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.post("/query", json={"query": query}, headers=headers)
+                    latencies.append(time.perf_counter() - start)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            start = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(args.requests)))
+            return latencies, statuses, time.perf_counter() - start
+
+    latencies, statuses, elapsed = asyncio.run(run_load())
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "throughput_rps": round(args.requests / elapsed, 3),
+        "status_codes": {str(code): count for code, count in statuses.items()},
+        "llm_calls": agent.llm.call_count + agent.fast_llm.call_count,
+        **_summary(latencies),
+    }
+
+def bench_burst(workdir: str, args) -> Dict:
+    """LLM calls when many analysts ask the same or near-identical question at once."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    agent = _build_agent(workdir, args, "burst")
+    variants = [
+        "Suspected ransomware on file server 01",
+        "suspected ransomware on file server 01",
+        "Suspected ransomware on the file server 01",
+    ]
+    calls = [(variants[i % len(variants)], "analyst" if i % 4 else "admin") for i in range(args.concurrency * 2)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        list(pool.map(lambda call: agent.run(call[0], role=call[1]), calls))
+    elapsed = time.perf_counter() - start
+    agent.close()
+    return {
+        "requests": len(calls),
+        "roles": sorted({role for _, role in calls}),
+        "llm_calls": agent.llm.call_count,
+        "seconds": round(elapsed, 3),
+        **agent.coalescer.stats(),
+    }
+
+def bench_tail_latency(workdir: str, args) -> Dict:
+    """End-to-end p99 when a fraction of LLM calls stall: no deadlines vs hedging vs a tight request budget."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    scenarios = {
+        "unbounded": {"hedge_percentile": 0, "request_budget": 3600, "stage_timeout": 3600},
+        "hedged": {"hedge_percentile": 95, "request_budget": 3600, "stage_timeout": 3600},
+        "budgeted": {"hedge_percentile": 95, "request_budget": args.tail_budget, "stage_timeout": args.tail_budget},
+    }
+    results = {}
+    for name, settings in scenarios.items():
+        agent = _build_agent(workdir, args, f"tail_{name}")
+        for llm in (agent.llm, agent.fast_llm):
+            llm.slow_rate = args.slow_rate
+            llm.slow_latency = args.slow_latency
+        agent.hedge_percentile = settings["hedge_percentile"]
+        agent.request_budget = settings["request_budget"]
+        agent.stage_timeouts = {stage: settings["stage_timeout"] for stage in agent.stage_timeouts}
+        # A fresh audit log per scenario so its growing rewrite cost doesn't skew later runs
+        audit_logger.LOG_FILE = os.path.join(workdir, f"audit_tail_{name}.json")
+
+        rng = random.Random(11)
+        # A unique token per query keeps every request a cache miss
+        queries = [f"{SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)].format(i=i)} ref {rng.getrandbits(32):08x}" for i in range(args.tail_requests)]
+
+        def one(query: str):
+            start = time.perf_counter()
+            result = agent.run(query, role="admin")
+            return time.perf_counter() - start, bool(result["degraded"])
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            outcomes = list(pool.map(one, queries))
+        agent.close()
+        results[name] = {
+            "requests": len(queries),
+            "degraded": sum(1 for _, degraded in outcomes if degraded),
+            "llm_calls": agent.llm.call_count + agent.fast_llm.call_count,
+            **_summary([latency for latency, _ in outcomes]),
+        }
+    return {"slow_rate": args.slow_rate, "slow_latency_s": args.slow_latency, **results}
+
+def bench_completion_cache(workdir: str, args) -> Dict:
+    """LLM calls when the same questions are asked by both roles, which the response cache keeps apart."""
+    agent = _build_agent(workdir, args, "completion")
+    # No log-scan keywords, so both roles render identical prompts
+    queries = ["Suspected ransomware on file server {i}", "Phishing email reported by finance user {i}"]
+    calls = [(q.format(i=i), role) for i in range(args.requests // 4) for q in queries for role in ("admin", "analyst")]
+    latencies = []
+    for query, role in calls:
+        start = time.perf_counter()
+        agent.run(query, role=role)
+        latencies.append(time.perf_counter() - start)
+    agent.close()
+    return {
+        "requests": len(calls),
+        "llm_calls": agent.llm.call_count + agent.fast_llm.call_count,
+        "llm_calls_without_cache": 2 * len(calls),
+        "completion_cache": agent.completion_cache.stats(),
+        **_summary(latencies),
+    }
+
+def bench_cache(workdir: str, args) -> Dict:
+    """Cache lookup cost per tier against the number of cached entries."""
+    results = {}
+    for size in args.cache_sizes:
+        cm = CacheManager(db_path=os.path.join(workdir, f"cache_{size}.db"), embeddings=FakeEmbeddings())
+        for i in range(size):
+            query = SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)].format(i=i)
+            cm.set(query, {"classification": "General", "report": {"findings": [query]}, "sources": []})
+        cm.flush()
+        hit_query = SAMPLE_QUERIES[0].format(i=0)
+        miss_query = "unrelated question about printer toner levels"
+        results[str(size)] = {
+            "local_hit": _summary(_timed(lambda: cm.get(hit_query), args.repeat)),
+            "semantic_hit": _summary(_timed(lambda: cm.get_semantic(hit_query, "analyst", ""), args.repeat)),
+            "miss": _summary(_timed(lambda: cm.get(miss_query), args.repeat)),
+            "other_role_miss": _summary(_timed(lambda: cm.get(hit_query, role="admin"), args.repeat)),
+        }
+        cm.close()
+    return results
+
+def bench_context(workdir: str, args) -> Dict:
+    """Prompt context size before and after dedup/merge/budgeting, and the cost of assembling it."""
+    from agent import RETRIEVAL_CANDIDATES
+    from context_builder import assemble_context, count_tokens
+
+    engine = _build_engine(workdir, "chroma_context", 0.0)
+    engine.ingest_documents()
+    log_path = os.path.join(workdir, "logs_context.json")
+    _write_synthetic_logs(log_path, 5000)
+    log_summary = LogAnalyzer(log_path=log_path).analyze_brute_force()
+    naive, assembled, samples = [], [], []
+    for i, template in enumerate(SAMPLE_QUERIES):
+        scored = engine.query_with_scores(template.format(i=i), k=RETRIEVAL_CANDIDATES)
+        naive.append(count_tokens("\n\n".join(doc.page_content for doc, _ in scored)) + count_tokens(log_summary))
+        start = time.perf_counter()
+        result = assemble_context(scored, log_summary)
+        samples.append(time.perf_counter() - start)
+        assembled.append(result["token_counts"]["context"] + result["token_counts"]["log"])
+    return {
+        "candidates": RETRIEVAL_CANDIDATES,
+        "naive_tokens_mean": round(statistics.mean(naive), 1),
+        "assembled_tokens_mean": round(statistics.mean(assembled), 1),
+        "assembly": _summary(samples),
+    }
+
+def _cache_worker(db_path: str, worker: int, operations: int) -> Dict[str, List[float]]:
+    cm = CacheManager(db_path=db_path, embeddings=FakeEmbeddings())
+    timings = {"get": [], "set": []}
+    for i in range(operations):
+        query = SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)].format(i=worker * operations + i)
+        if i % 4 == 0:
+            start = time.perf_counter()
+            cm.set(query, {"classification": "General", "report": {"findings": [query]}, "sources": []})
+            timings["set"].append(time.perf_counter() - start)
+        else:
+            start = time.perf_counter()
+            cm.get(query)
+            timings["get"].append(time.perf_counter() - start)
+    start = time.perf_counter()
+    cm.close()
+    timings["close"] = [time.perf_counter() - start]
+    return timings
+
+def bench_cache_concurrency(workdir: str, args) -> Dict:
+    """Mixed get/set load on one cache database from several worker processes."""
+    from multiprocessing import Pool
+
+    db_path = os.path.join(workdir, "cache_concurrency.db")
+    seed = CacheManager(db_path=db_path, embeddings=FakeEmbeddings())
+    for i in range(500):
+        seed.set(f"seed query {i}", {"classification": "General", "report": {}, "sources": []})
+    seed.close()
+
+    operations = args.repeat * 4
+    start = time.perf_counter()
+    with Pool(args.concurrency) as pool:
+        timings = pool.starmap(_cache_worker, [(db_path, w, operations) for w in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "workers": args.concurrency,
+        "operations_per_second": round(args.concurrency * operations / elapsed, 1),
+        "get": _summary([t for worker in timings for t in worker["get"]]),
+        "set": _summary([t for worker in timings for t in worker["set"]]),
+        "close": _summary([t for worker in timings for t in worker["close"]]),
+    }
+
+def bench_ingest(workdir: str, args) -> Dict:
+    """Chunk count, ingestion rate and retrieval latency per chunking strategy."""
+    results = {}
+    queries = [q.format(i=i) for i, q in enumerate(SAMPLE_QUERIES)]
+    for chunking in ("recursive", "structured"):
+        engine = _build_engine(workdir, f"chroma_ingest_{chunking}", args.embedding_latency, chunking)
+        start = time.perf_counter()
+        chunks = engine.ingest_documents()
+        elapsed = time.perf_counter() - start
+        samples = _timed(lambda: [engine.query(q) for q in queries], args.repeat)
+        results[chunking] = {
+            "chunks": chunks,
+            "seconds": round(elapsed, 3),
+            "chunks_per_second": round(chunks / elapsed, 3),
+            "retrieval": _summary([s / len(queries) for s in samples]),
+        }
+    return results
+
+def bench_ingest_swap(workdir: str, args) -> Dict:
+    """Query latency and index consistency while a background ingest job rebuilds the index."""
+    from ingest_jobs import IngestJobManager
+
+    import shutil
+
+    data_dir = os.path.join(workdir, "knowledge_swap")
+    shutil.copytree(KNOWLEDGE_DIR, data_dir)
+
+    def engine(embedding_latency: float) -> RAGEngine:
+        return RAGEngine(data_dir=data_dir, persist_dir=os.path.join(workdir, "chroma_swap"),
+                         embeddings=FakeEmbeddings(latency=embedding_latency),
+                         snapshot_dir=os.path.join(workdir, "chroma_swap_snapshot"))
+
+    reader = engine(0.0)
+    reader.ingest_documents()
+    initial_version = reader.kb_version()
+    queries = [q.format(i=i) for i, q in enumerate(SAMPLE_QUERIES)]
+    idle = _timed(lambda: reader.query_with_scores(queries[0], k=5), args.repeat)
+
+    # New content for the rebuild; a second engine on the same directories stands
+    # in for the worker that accepted /ingest
+    with open(os.path.join(data_dir, "benchmark_addendum.md"), "w") as f:
+        f.write("# Benchmark Addendum\n\nRotate credentials after any confirmed brute force login.\n")
+    writer = engine(args.embedding_latency * 4)
+    writer.ingest_batch_size = 16
+    jobs = IngestJobManager(writer, jobs_dir=os.path.join(workdir, "ingest_jobs"))
+    start = time.perf_counter()
+    job = jobs.start(requested_by="benchmark")
+    busy, short_results, errors, versions = [], 0, 0, set()
+    while True:
+        status = jobs.get(job["job_id"])
+        if status["status"] in ("completed", "failed", "cancelled"):
+            break
+        query_start = time.perf_counter()
+        try:
+            versions.add(reader.kb_version())
+            if len(reader.query_with_scores(queries[len(busy) % len(queries)], k=5)) < 5:
+                short_results += 1
+        except Exception:
+            errors += 1
+        busy.append(time.perf_counter() - query_start)
+    elapsed = time.perf_counter() - start
+    versions.add(reader.kb_version())
+
+    # Cancelling a second rebuild must leave the live index in place
+    live_version = reader.kb_version()
+    cancelled = jobs.start(requested_by="benchmark")
+    time.sleep(0.05)
+    jobs.cancel(cancelled["job_id"])
+    while jobs.get(cancelled["job_id"])["status"] not in ("completed", "failed", "cancelled"):
+        time.sleep(0.01)
+    return {
+        "job_status": status["status"],
+        "job_seconds": round(elapsed, 3),
+        "chunks": status["chunks_total"],
+        "queries_during_ingest": len(busy),
+        "query_errors": errors,
+        "short_results": short_results,
+        "kb_versions_seen": len(versions),
+        "readers_switched": initial_version != status["kb_version"] == live_version,
+        "cancelled_job_status": jobs.get(cancelled["job_id"])["status"],
+        "live_index_kept_after_cancel": reader.kb_version() == live_version,
+        "idle_query": _summary(idle),
+        "query_during_ingest": _summary(busy),
+    }
+
+def _rss_mb(field: str = "VmRSS") -> float:
+    """Resident memory from /proc; RssAnon excludes file-backed pages shared through the page cache."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def _cold_start_child(mode: str, persist_dir: str, snapshot_dir: str, dim: int) -> Dict:
+    """Runs in a fresh interpreter: open the index and serve one query, as a new worker would."""
+    baseline, baseline_anon = _rss_mb(), _rss_mb("RssAnon")
+    start = time.perf_counter()
+    engine = RAGEngine(persist_dir=persist_dir, embeddings=FakeEmbeddings(dim=dim),
+                       snapshot_dir=snapshot_dir if mode != "chroma" else None)
+    engine.snapshot_rescore = mode != "snapshot_no_rescore"
+    engine.query_with_scores(SAMPLE_QUERIES[0].format(i=0), k=5)
+    first_query = time.perf_counter() - start
+    warm = _timed(lambda: engine.query_with_scores(SAMPLE_QUERIES[1].format(i=1), k=5), 20)
+    return {
+        "first_query_ms": round(first_query * 1000, 3),
+        "warm_query": _summary(warm),
+        "rss_delta_mb": round(_rss_mb() - baseline, 2),
+        "private_rss_delta_mb": round(_rss_mb("RssAnon") - baseline_anon, 2),
+    }
+
+def bench_cold_start(workdir: str, args) -> Dict:
+    """Per-worker cold start and resident memory: Chroma client vs memory-mapped snapshot."""
+    import multiprocessing
+    from langchain_core.documents import Document
+    from langchain_community.vectorstores import Chroma
+
+    dim, count = args.snapshot_dim, args.snapshot_chunks
+    rng = random.Random(11)
+    vocabulary = [f"term{i}" for i in range(5000)]
+    docs = [Document(page_content=" ".join(rng.choices(vocabulary, k=120)), metadata={"doc_id": f"synthetic-{i}", "chunk_id": f"c{i}"})
+            for i in range(count)]
+    persist_dir = os.path.join(workdir, "chroma_cold_start")
+    snapshot_dir = os.path.join(workdir, "snapshot_cold_start")
+    engine = RAGEngine(persist_dir=persist_dir, embeddings=FakeEmbeddings(dim=dim), snapshot_dir=snapshot_dir)
+    engine.vector_store = Chroma(persist_directory=persist_dir, embedding_function=engine.embeddings)
+    for start in range(0, count, 1000):
+        batch = docs[start:start + 1000]
+        engine.vector_store.add_documents(batch, ids=[d.metadata["chunk_id"] for d in batch])
+    engine.export_snapshot()
+
+    results = {"chunks": count, "dim": dim}
+    context = multiprocessing.get_context("spawn")
+    for mode in ("chroma", "snapshot", "snapshot_no_rescore"):
+        with context.Pool(1) as pool:
+            results[mode] = pool.apply(_cold_start_child, (mode, persist_dir, snapshot_dir, dim))
+    return results
+
+def bench_log_analyzer(workdir: str, args) -> Dict:
+    """LogAnalyzer.analyze_brute_force throughput on synthetic logs."""
+    log_path = os.path.join(workdir, "synthetic_logs.json")
+    _write_synthetic_logs(log_path, args.log_records)
+    analyzer = LogAnalyzer(log_path=log_path)
+    samples = _timed(analyzer.analyze_brute_force, max(1, args.repeat // 10))
+    return {
+        "records": args.log_records,
+        "records_per_second": round(args.log_records / statistics.mean(samples), 1),
+        **_summary(samples),
+    }
+
+def bench_audit(workdir: str, args) -> Dict:
+    """Cost of one audit write against the number of entries already logged."""
+    results = {}
+    original_log_file = audit_logger.LOG_FILE
+    try:
+        for size in args.audit_sizes:
+            audit_logger.LOG_FILE = os.path.join(workdir, f"audit_{size}.json")
+            entry = {"timestamp": datetime.utcnow().isoformat(), "user": "bench", "role": "analyst",
+                     "query": "seed", "classification": "General", "report": "seed report",
+                     "model_version": "fake", "sources_referenced": [], "retrieved_chunks": []}
+            with open(audit_logger.LOG_FILE, "w") as f:
+                json.dump([entry] * size, f)
+            samples = _timed(lambda: audit_logger.log_incident_query(
+                username="bench", role="analyst", query="benchmark query", classification="General",
+                report="benchmark report", sources=["Source 1"], retrieved_chunks=[],
+            ), max(1, args.repeat // 10))
+            results[str(size)] = _summary(samples)
+    finally:
+        audit_logger.LOG_FILE = original_log_file
+    return results
+
+def _rate_limit_worker(uri: str, hits: int) -> int:
+    from limits import parse
+    from limits.storage import storage_from_string
+    from limits.strategies import FixedWindowRateLimiter
+    import rate_limiter  # noqa: F401  registers the sqlite:// scheme
+
+    limiter = FixedWindowRateLimiter(storage_from_string(uri))
+    limit = parse("100/minute")
+    return sum(1 for _ in range(hits) if limiter.hit(limit, "bench", "shared"))
+
+def bench_rate_limit(workdir: str, args) -> Dict:
+    """Per-request limiter overhead per storage backend and cross-process budget enforcement."""
+    from multiprocessing import Pool
+    from limits import parse
+    from limits.storage import storage_from_string
+    from limits.strategies import FixedWindowRateLimiter
+    from starlette.requests import Request
+    from auth import create_access_token
+    from rate_limiter import rate_limit_key
+
+    token = create_access_token({"sub": "analyst"})
+    request = Request({"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())], "client": ("10.0.0.1", 4242)})
+    results = {"key_func": _summary(_timed(lambda: rate_limit_key(request), args.repeat * 10))}
+
+    sqlite_uri = f"sqlite://{os.path.join(workdir, 'ratelimit.db')}"
+    limit = parse("1000000/minute")
+    for name, uri in (("memory", "memory://"), ("sqlite", sqlite_uri)):
+        limiter = FixedWindowRateLimiter(storage_from_string(uri))
+        results[name] = _summary(_timed(lambda: limiter.hit(limit, "user:analyst:analyst", "query"), args.repeat * 10))
+
+    hits_per_worker = 200
+    start = time.perf_counter()
+    with Pool(args.concurrency) as pool:
+        allowed = pool.starmap(_rate_limit_worker, [(sqlite_uri, hits_per_worker)] * args.concurrency)
+    elapsed = time.perf_counter() - start
+    results["sqlite_cross_process"] = {
+        "workers": args.concurrency,
+        "budget": 100,
+        "allowed": sum(allowed),
+        "hits_per_second": round(args.concurrency * hits_per_worker / elapsed, 1),
+    }
+    return results
+
+BENCHMARKS = {
+    "query": bench_query,
+    "burst": bench_burst,
+    "tail_latency": bench_tail_latency,
+    "completion_cache": bench_completion_cache,
+    "cache": bench_cache,
+    "cache_concurrency": bench_cache_concurrency,
+    "ingest": bench_ingest,
+    "ingest_swap": bench_ingest_swap,
+    "context": bench_context,
+    "cold_start": bench_cold_start,
+    "log_analyzer": bench_log_analyzer,
+    "audit": bench_audit,
+    "rate_limit": bench_rate_limit,
+}
+
+def _flatten(data: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+def compare(previous: Dict, current: Dict):
+    """Prints the relative change of every numeric metric present in both runs."""
+    old, new = _flatten(previous["results"]), _flatten(current["results"])
+    print(f"{'metric':<60} {'previous':>12} {'current':>12} {'change':>9}")
+    for key in sorted(old.keys() & new.keys()):
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        print(f"{key:<60} {old[key]:>12} {new[key]:>12} {change:>+8.1f}%")
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline SOC RAGBot benchmarks")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="Comma-separated benchmarks to run")
+    parser.add_argument("--output", help="Write JSON results to this path (default: stdout)")
+    parser.add_argument("--compare", help="Previous JSON results to diff against")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Stand-in LLM latency in seconds")
+    parser.add_argument("--embedding-latency", type=float, default=0.005, help="Stand-in embedding latency in seconds")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="Fraction of stand-in LLM calls that stall (tail_latency)")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="Latency of a stalled LLM call in seconds (tail_latency)")
+    parser.add_argument("--tail-budget", type=float, default=0.5, help="Request budget for the budgeted tail_latency scenario")
+    parser.add_argument("--tail-requests", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--cache-sizes", type=_int_list, default=[100, 1000, 3000])
+    parser.add_argument("--audit-sizes", type=_int_list, default=[100, 1000, 5000])
+    parser.add_argument("--log-records", type=int, default=50000)
+    parser.add_argument("--snapshot-chunks", type=int, default=5000, help="Synthetic index size for cold_start")
+    parser.add_argument("--snapshot-dim", type=int, default=768, help="Embedding dimension for cold_start")
+    args = parser.parse_args()
+
+    selected = [name for name in args.only.split(",") if name]
+    unknown = set(selected) - BENCHMARKS.keys()
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    output = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "results": {},
+    }
+    failed = []
+    with tempfile.TemporaryDirectory(prefix="ragbot-bench-") as workdir:
+        original_log_file = audit_logger.LOG_FILE
+        audit_logger.LOG_FILE = os.path.join(workdir, "audit_log.json")
+        try:
+            # The app modules print DEBUG lines; keep stdout clean for the JSON results
+            with redirect_stdout(sys.stderr):
+                for name in selected:
+                    print(f"Running benchmark: {name}")
+                    try:
+                        output["results"][name] = BENCHMARKS[name](workdir, args)
+                    except Exception as e:
+                        # Record the failure and keep going so one broken section doesn't lose the rest
+                        traceback.print_exc()
+                        output["results"][name] = {"error": str(e)}
+                        failed.append(name)
+        finally:
+            audit_logger.LOG_FILE = original_log_file
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), output)
+
+    if failed:
+        print(f"Failed benchmarks: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,77 +1,283 @@
 import os
+import re
+import copy
 import json
+import time
+import queue
+import atexit
 import sqlite3
+import threading
 import numpy as np
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Tuple
 from langchain_openai import OpenAIEmbeddings
 
+_STOP = object()
+
+def normalize_query(query: str) -> str:
+    """Key for the exact-match tier: case, whitespace and trailing punctuation don't matter."""
+    return re.sub(r"\s+", " ", query).strip().rstrip("?.! ").lower()
+
+class _TierStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+
+    def record(self, hit: bool, elapsed: float):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.lookup_seconds += elapsed
+
+    def as_dict(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "avg_lookup_ms": round(self.lookup_seconds / lookups * 1000, 3) if lookups else 0.0,
+        }
+
 class CacheManager:
-    def __init__(self, db_path: str = "../data/cache.db"):
+    """
+    Two-tier response cache, partitioned by role and knowledge-base version.
+
+    Tier 1 is an in-process LRU keyed by the normalized query text, so exact
+    repeats cost neither an embedding call nor a disk scan. Tier 2 is the
+    semantic SQLite cache shared by all workers. Tier 2 hits are promoted
+    into tier 1.
+    """
+
+    def __init__(self, db_path: str = "../data/cache.db", embeddings=None, batch_size: int = 32, local_size: int = None,
+                 pool_size: int = 8):
         self.db_path = os.path.abspath(os.path.join(os.path.dirname(__file__), db_path))
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        self.embeddings = OpenAIEmbeddings()
+        self.embeddings = embeddings or OpenAIEmbeddings()
+        self.batch_size = batch_size
+        self.local_size = local_size if local_size is not None else int(os.getenv("CACHE_LOCAL_SIZE", "256"))
+        self._local_cache: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._local_lock = threading.Lock()
+        self._stats = {"local": _TierStats(), "semantic": _TierStats()}
+        self._closed = False
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=pool_size)
         self._init_db()
 
+        # Write-behind: set() only enqueues; a single writer thread embeds and
+        # inserts in batches so the request path never waits on the cache.
+        self._write_queue: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="cache-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _open_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=10.0, check_same_thread=False, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        """
+        Checks a connection out of the pool, opening one if none is idle.
+
+        Long-lived connections keep sqlite3's prepared statement cache warm.
+        At most pool_size idle connections are kept; extras (and any returned
+        after close()) are closed, so short-lived threadpool workers can't
+        leak connections.
+        """
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._open_connection()
+        try:
+            yield conn
+        finally:
+            if self._closed:
+                conn.close()
+            else:
+                try:
+                    self._pool.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+
     def _init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS semantic_cache (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    query TEXT UNIQUE,
-                    query_vector BLOB,
-                    response TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
+        with self._connection() as conn:
+            self._create_schema(conn)
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(semantic_cache)")]
+        if columns and "role" not in columns:
+            # Entries from before role partitioning could leak admin-only analysis; drop them
+            conn.execute("DROP TABLE semantic_cache")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS semantic_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                query TEXT,
+                role TEXT NOT NULL,
+                kb_version TEXT NOT NULL,
+                query_vector BLOB,
+                response TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (query, role, kb_version)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_semantic_cache_partition ON semantic_cache (role, kb_version)")
+        conn.commit()
+
+    def _put_local(self, key: Tuple[str, str, str], response: Dict[str, Any]):
+        with self._local_lock:
+            self._local_cache[key] = response
+            self._local_cache.move_to_end(key)
+            while len(self._local_cache) > self.local_size:
+                self._local_cache.popitem(last=False)
 
-    def _cosine_similarity(self, v1: np.ndarray, v2: np.ndarray) -> float:
-        return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
+    def embed(self, query: str) -> np.ndarray:
+        return np.array(self.embeddings.embed_query(query))
 
-    def get(self, query: str, threshold: float = 0.90) -> Optional[Dict[str, Any]]:
-        """Retrieves a cached response if a semantically similar query exists."""
+    def get_local(self, query: str, role: str, kb_version: str) -> Optional[Dict[str, Any]]:
+        """Tier 1: exact normalized-query match in this process."""
+        start = time.perf_counter()
+        key = (role, kb_version, normalize_query(query))
+        with self._local_lock:
+            response = self._local_cache.get(key)
+            if response is not None:
+                self._local_cache.move_to_end(key)
+            self._stats["local"].record(response is not None, time.perf_counter() - start)
+        return copy.deepcopy(response) if response is not None else None
+
+    def get_semantic(self, query: str, role: str, kb_version: str, threshold: float = 0.90,
+                     query_vector: Optional[np.ndarray] = None) -> Optional[Dict[str, Any]]:
+        """Tier 2: semantically similar query within the same role and knowledge-base version."""
+        start = time.perf_counter()
+        response = None
         try:
-            query_vector = np.array(self.embeddings.embed_query(query))
-            
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute("SELECT query, query_vector, response FROM semantic_cache")
-                rows = cursor.fetchall()
-
-            best_match = None
-            max_sim = -1
-            best_query = ""
-
-            for cached_query, cached_vector_blob, response_json in rows:
-                cached_vector = np.frombuffer(cached_vector_blob, dtype=np.float64)
-                sim = self._cosine_similarity(query_vector, cached_vector)
-                
-                if sim > max_sim:
-                    max_sim = sim
-                    best_match = response_json
-                    best_query = cached_query
-
-            if max_sim >= threshold:
+            if query_vector is None:
+                query_vector = self.embed(query)
+
+            with self._connection() as conn:
+                rows = conn.execute(
+                    "SELECT id, query, query_vector FROM semantic_cache WHERE role = ? AND kb_version = ?",
+                    (role, kb_version)
+                ).fetchall()
+
+                if rows:
+                    matrix = np.frombuffer(b"".join(row[2] for row in rows), dtype=np.float64).reshape(len(rows), -1)
+                    sims = matrix @ query_vector / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector))
+                    best = int(np.argmax(sims))
+                    best_query, max_sim = rows[best][1], float(sims[best])
+                else:
+                    best_query, max_sim = "", -1.0
+
+                response_json = None
+                if max_sim >= threshold:
+                    # Only the winning row's response is read and decoded
+                    response_json = conn.execute("SELECT response FROM semantic_cache WHERE id = ?", (rows[best][0],)).fetchone()[0]
+
+            if response_json is not None:
                 print(f"DEBUG: Semantic cache hit! Similarity with '{best_query}': {max_sim:.4f}")
-                return json.loads(best_match)
-            
-            print(f"DEBUG: Cache miss. Best match ('{best_query}') similarity: {max_sim:.4f}")
-            return None
+                response = json.loads(response_json)
+                self._put_local((role, kb_version, normalize_query(query)), response)
+                response = copy.deepcopy(response)
+            else:
+                print(f"DEBUG: Cache miss. Best match ('{best_query}') similarity: {max_sim:.4f}")
         except Exception as e:
             print(f"DEBUG: Cache lookup error: {e}")
-            return None
 
-    def set(self, query: str, response: Dict[str, Any]):
-        """Caches a query and its response."""
+        with self._local_lock:
+            self._stats["semantic"].record(response is not None, time.perf_counter() - start)
+        return response
+
+    def get(self, query: str, role: str = "analyst", kb_version: str = "", threshold: float = 0.90,
+            query_vector: Optional[np.ndarray] = None) -> Optional[Dict[str, Any]]:
+        """Retrieves a cached response from the first tier that has one."""
+        response = self.get_local(query, role, kb_version)
+        if response is None:
+            response = self.get_semantic(query, role, kb_version, threshold, query_vector)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._local_lock:
+            return {
+                "local": dict(self._stats["local"].as_dict(), size=len(self._local_cache), capacity=self.local_size),
+                "semantic": self._stats["semantic"].as_dict(),
+                "pending_writes": self._write_queue.qsize(),
+            }
+
+    def set(self, query: str, response: Dict[str, Any], role: str = "analyst", kb_version: str = "",
+            query_vector: Optional[np.ndarray] = None):
+        """Stores a response in tier 1 now and queues it for the tier 2 writer.
+
+        Pass the query_vector used for the lookup to save the writer an embedding call.
+        """
+        if self._closed:
+            return
+        self._put_local((role, kb_version, normalize_query(query)), copy.deepcopy(response))
+        self._write_queue.put((query, role, kb_version, response, query_vector))
+
+    def flush(self):
+        """Blocks until every queued write has been committed."""
+        self._write_queue.join()
+
+    def close(self):
+        """Flushes pending writes and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._write_queue.put(_STOP)
+        self._writer.join()
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _write_loop(self):
+        while True:
+            item = self._write_queue.get()
+            if item is _STOP:
+                self._write_queue.task_done()
+                return
+
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in range(len(batch) + stop):
+                    self._write_queue.task_done()
+            if stop:
+                return
+
+    def _write_batch(self, batch: List[tuple]):
+        """Embeds (where no vector was given) and inserts a batch of cache entries in a single transaction."""
         try:
-            query_vector = np.array(self.embeddings.embed_query(query))
-            response_json = json.dumps(response)
-            
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute(
-                    "INSERT OR REPLACE INTO semantic_cache (query, query_vector, response) VALUES (?, ?, ?)",
-                    (query, query_vector.tobytes(), response_json)
+            missing = [i for i, item in enumerate(batch) if item[4] is None]
+            vectors = [item[4] for item in batch]
+            if missing:
+                for i, vector in zip(missing, self.embeddings.embed_documents([batch[i][0] for i in missing])):
+                    vectors[i] = vector
+            rows = [
+                (query, role, kb_version, np.asarray(vector, dtype=np.float64).tobytes(), json.dumps(response))
+                for (query, role, kb_version, response, _), vector in zip(batch, vectors)
+            ]
+            with self._connection() as conn, conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO semantic_cache (query, role, kb_version, query_vector, response) VALUES (?, ?, ?, ?, ?)",
+                    rows
                 )
-                conn.commit()
         except Exception as e:
             print(f"DEBUG: Cache save error: {e}")
 
@@ -82,5 +288,7 @@ if __name__ == "__main__":
     test_response = {"report": "test report", "classification": "Ransomware", "sources": []}
     
     cm.set(test_query, test_response)
+    cm.flush()
     hit = cm.get("ransomware handling steps")
     print(f"Result for similar query: {hit}")
+    print(f"Cache stats: {cm.stats()}")
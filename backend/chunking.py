@@ -0,0 +1,144 @@
+import os
+import re
+import hashlib
+from typing import List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from context_builder import count_tokens
+
+MAX_CHUNK_TOKENS = 512
+# Consecutive small markdown sections are packed together up to this size
+TARGET_CHUNK_TOKENS = 256
+PLAYBOOK_STEPS_HEADER = "Response Playbook Steps:"
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*$", re.MULTILINE)
+_PHASE = re.compile(r"^- \[([^\]]+)\]")
+
+def _chunk_id(meta: dict, section: str, index: int, base_dir: Optional[str] = None) -> str:
+    """
+    Stable across re-ingests as long as the document's structure is unchanged.
+
+    The source is hashed relative to base_dir, so moving the checkout or the
+    data directory doesn't change IDs (and with them the snapshot version).
+    """
+    source = meta.get("source") or ""
+    if base_dir and source:
+        source = os.path.relpath(source, base_dir).replace(os.sep, "/")
+    key = f"{source}|{meta.get('doc_id')}|{section}|{index}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+def _make_chunk(doc: Document, content: str, section: str, index: int, start_index: int = None,
+                base_dir: Optional[str] = None) -> Document:
+    meta = dict(doc.metadata)
+    meta["section"] = section
+    meta["chunk_id"] = _chunk_id(doc.metadata, section, index, base_dir)
+    meta["token_count"] = count_tokens(content)
+    if start_index is not None:
+        meta["start_index"] = start_index
+    return Document(page_content=content, metadata=meta)
+
+def _fallback_split(doc: Document, text: str, section: str, offset: int, first_index: int = 0,
+                    base_dir: Optional[str] = None) -> List[Document]:
+    """Splits an oversized section at paragraph/sentence boundaries without overlap."""
+    # count_tokens falls back to an estimate when the tiktoken encoding can't be loaded (offline)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=MAX_CHUNK_TOKENS, chunk_overlap=0, length_function=count_tokens)
+    chunks, cursor = [], 0
+    for i, piece in enumerate(splitter.split_text(text)):
+        start = text.find(piece, cursor)
+        cursor = max(cursor, start)
+        chunks.append(_make_chunk(doc, piece, section, first_index + i, offset + start if start != -1 else None, base_dir))
+    return chunks
+
+def split_playbook_record(doc: Document, base_dir: Optional[str] = None) -> List[Document]:
+    """One chunk per rendered playbook record, or one per response phase when it is too long."""
+    text = doc.page_content
+    if count_tokens(text) <= MAX_CHUNK_TOKENS or PLAYBOOK_STEPS_HEADER not in text:
+        return [_make_chunk(doc, text, "record", 0, base_dir=base_dir)]
+
+    header, steps = text.split(PLAYBOOK_STEPS_HEADER, 1)
+    title = header.splitlines()[0]
+    phases: List[Tuple[str, List[str]]] = []
+    trailer = []
+    for line in steps.strip("\n").splitlines():
+        match = _PHASE.match(line)
+        if match:
+            if not phases or phases[-1][0] != match.group(1):
+                phases.append((match.group(1), []))
+            phases[-1][1].append(line)
+        else:
+            trailer.append(line)
+
+    chunks = [_make_chunk(doc, header.rstrip("\n") + ("\n" + "\n".join(trailer) if trailer else ""), "overview", 0, base_dir=base_dir)]
+    for i, (phase, lines) in enumerate(phases, start=1):
+        content = f"{title}\n{PLAYBOOK_STEPS_HEADER}\n" + "\n".join(lines)
+        chunks.append(_make_chunk(doc, content, f"phase:{phase}", i, base_dir=base_dir))
+    return chunks
+
+def split_markdown(doc: Document, base_dir: Optional[str] = None) -> List[Document]:
+    """
+    Splits markdown on headings, carrying the heading path as the section name.
+
+    Small consecutive sections are packed up to TARGET_CHUNK_TOKENS and
+    oversized ones fall back to a token-based split without overlap.
+    """
+    text = doc.page_content
+    matches = list(_HEADING.finditer(text))
+    boundaries = [0] + [m.start() for m in matches if m.start() > 0] + [len(text)]
+
+    sections, path, pending = [], [], None
+    for start, end in zip(boundaries, boundaries[1:]):
+        heading = _HEADING.match(text, start)
+        if heading and heading.start() == start:
+            level = len(heading.group(1))
+            path = path[:level - 1] + [heading.group(2)]
+            if not text[heading.end():end].strip():
+                # A heading with no body of its own is kept with its first subsection
+                pending = start if pending is None else pending
+                continue
+        if pending is not None:
+            start, pending = pending, None
+        if text[start:end].strip():
+            sections.append((start, end, " > ".join(path) or "preamble"))
+
+    chunks, group = [], []
+
+    def emit():
+        if group:
+            start, end = group[0][0], group[-1][1]
+            chunks.append(_make_chunk(doc, text[start:end], "; ".join(g[2] for g in group), len(chunks), start, base_dir))
+            group.clear()
+
+    for start, end, section in sections:
+        tokens = count_tokens(text[start:end])
+        if tokens > MAX_CHUNK_TOKENS:
+            emit()
+            chunks.extend(_fallback_split(doc, text[start:end], section, start, len(chunks), base_dir))
+            continue
+        if group and count_tokens(text[group[0][0]:end]) > TARGET_CHUNK_TOKENS:
+            emit()
+        group.append((start, end, section))
+    emit()
+    return chunks or [_make_chunk(doc, text, "document", 0, base_dir=base_dir)]
+
+def split_documents(docs: List[Document], base_dir: Optional[str] = None) -> List[Document]:
+    """Routes each source document to the splitter for its structure; base_dir anchors chunk IDs."""
+    chunks = []
+    for doc in docs:
+        source = doc.metadata.get("source", "")
+        if doc.metadata.get("type") == "playbook":
+            chunks.extend(split_playbook_record(doc, base_dir))
+        elif source.endswith(".md"):
+            chunks.extend(split_markdown(doc, base_dir))
+        else:
+            chunks.extend(_fallback_split(doc, doc.page_content, "document", 0, base_dir=base_dir))
+
+    # Records that reuse a doc_id in the same file would otherwise collide
+    seen = {}
+    for chunk in chunks:
+        chunk_id = chunk.metadata["chunk_id"]
+        if chunk_id in seen:
+            seen[chunk_id] += 1
+            chunk.metadata["chunk_id"] = f"{chunk_id}-{seen[chunk_id]}"
+        else:
+            seen[chunk_id] = 0
+    return chunks
@@ -0,0 +1,71 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from langchain_core.messages import AIMessage, BaseMessage
+
+class CompletionCache:
+    """
+    Exact-match cache of LLM completions for deterministic (temperature=0) chains.
+
+    Keys combine the model, its temperature, the prompt template version and
+    a hash of the fully rendered messages. Any change to the query, retrieved
+    context or log summary is therefore a different key, and so is a prompt
+    edit once its version constant is bumped. Entries are evicted LRU beyond
+    max_entries; hits and misses are counted per stage.
+    """
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("COMPLETION_CACHE_SIZE", "1024"))
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        # stage -> [hits, misses]
+        self._counts: Dict[str, List[int]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def key(self, llm, template_version: str, messages: List[BaseMessage]) -> str:
+        payload = json.dumps({
+            "model": getattr(llm, "model_name", None) or type(llm).__name__,
+            "temperature": getattr(llm, "temperature", None),
+            "template": template_version,
+            "messages": [[m.type, m.content] for m in messages],
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, stage: str, key: str) -> Optional[AIMessage]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+            self._counts.setdefault(stage, [0, 0])[0 if content is not None else 1] += 1
+        # Only the text is kept, so a hit never reports the original call's token usage
+        return AIMessage(content=content) if content is not None else None
+
+    def put(self, key: str, response: BaseMessage):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = response.content
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            result = {}
+            for stage, (hits, misses) in self._counts.items():
+                lookups = hits + misses
+                result[stage] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                }
+            result["entries"] = len(self._entries)
+            return result
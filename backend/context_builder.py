@@ -0,0 +1,178 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+NEAR_DUPLICATE_THRESHOLD = 0.85
+MIN_OVERLAP_CHARS = 20
+
+_encoding = None
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Counts tokens with tiktoken, falling back to a ~4 chars/token estimate offline."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model(model)
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+def _truncate_tokens(text: str, max_tokens: int) -> str:
+    if _encoding:
+        return _encoding.decode(_encoding.encode(text)[:max_tokens])
+    return text[:max_tokens * 4]
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of `a` that is also a prefix of `b`."""
+    probe = b[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    start = max(0, len(a) - len(b))
+    while True:
+        pos = a.find(probe, start)
+        if pos == -1:
+            return 0
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        start = pos + 1
+
+def _merge_pair(first: Dict, second: Dict) -> Optional[Dict]:
+    """Merges two chunks of the same document if they overlap or touch."""
+    a, b = first["metadata"].get("start_index"), second["metadata"].get("start_index")
+    if a is not None and b is not None:
+        if a > b:
+            first, second, a, b = second, first, b, a
+        end = a + len(first["content"])
+        if end < b:
+            return None
+        content = first["content"] + second["content"][end - b:]
+    else:
+        size = _overlap(first["content"], second["content"])
+        if not size:
+            size = _overlap(second["content"], first["content"])
+            if not size:
+                return None
+            first, second = second, first
+        content = first["content"] + second["content"][size:]
+    return {
+        "content": content,
+        "metadata": dict(first["metadata"], merged_chunks=first["metadata"].get("merged_chunks", 1) + second["metadata"].get("merged_chunks", 1)),
+        "score": max(first["score"], second["score"]),
+    }
+
+def _merge_adjacent(chunks: List[Dict]) -> List[Dict]:
+    """Collapses overlapping or adjacent chunks from the same doc_id into one span."""
+    groups: Dict[Tuple, List[Dict]] = {}
+    for chunk in chunks:
+        meta = chunk["metadata"]
+        groups.setdefault((meta.get("source"), meta.get("doc_id")), []).append(chunk)
+
+    merged = []
+    for group in groups.values():
+        changed = True
+        while changed and len(group) > 1:
+            changed = False
+            for i in range(len(group)):
+                for j in range(i + 1, len(group)):
+                    combined = _merge_pair(group[i], group[j])
+                    if combined:
+                        group = [c for k, c in enumerate(group) if k not in (i, j)] + [combined]
+                        changed = True
+                        break
+                if changed:
+                    break
+        merged.extend(group)
+    return sorted(merged, key=lambda c: c["score"], reverse=True)
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def _drop_near_duplicates(chunks: List[Dict]) -> List[Dict]:
+    """Keeps the higher-ranked copy of chunks whose text is (almost) contained in another."""
+    kept, kept_shingles = [], []
+    for chunk in chunks:
+        shingles = _shingles(chunk["content"])
+        duplicate = False
+        for other in kept_shingles:
+            common = len(shingles & other)
+            if common / max(1, len(shingles)) >= NEAR_DUPLICATE_THRESHOLD or \
+                    common / max(1, len(shingles | other)) >= NEAR_DUPLICATE_THRESHOLD:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(chunk)
+            kept_shingles.append(shingles)
+    return kept
+
+def _label(index: int, meta: dict) -> Tuple[str, str]:
+    source_label = f"Source {index}"
+    return source_label, f"[{source_label}: {meta.get('doc_id', 'N/A')} v{meta.get('version', '1.0')}]"
+
+def assemble_context(scored_docs: List[Tuple[Document, float]], log_context: str = "", token_budget: int = DEFAULT_TOKEN_BUDGET) -> Dict:
+    """
+    Builds the prompt context from retrieved chunks.
+
+    Overlapping and adjacent chunks of a document are merged, near-duplicates
+    dropped, and the rest packed by retrieval score into `token_budget`
+    (shared with the log summary) before being labelled [Source X].
+    """
+    chunks = [{"content": doc.page_content, "metadata": dict(doc.metadata), "score": float(score)} for doc, score in scored_docs]
+    candidates = len(chunks)
+    chunks = _drop_near_duplicates(_merge_adjacent(sorted(chunks, key=lambda c: c["score"], reverse=True)))
+
+    # The log summary is capped at half the budget; retrieved context gets the rest
+    log_tokens = count_tokens(log_context) if log_context else 0
+    if log_tokens > token_budget // 2:
+        log_context = _truncate_tokens(log_context, token_budget // 2) + "\n[truncated]"
+        log_tokens = count_tokens(log_context)
+    remaining = token_budget - log_tokens
+
+    selected = []
+    for chunk in chunks:
+        _, label = _label(len(selected) + 1, chunk["metadata"])
+        meta = chunk["metadata"]
+        if "token_count" in meta and "merged_chunks" not in meta:
+            # Precomputed at ingest time by the structure-aware splitters
+            tokens = meta["token_count"] + count_tokens(label) + 1
+        else:
+            tokens = count_tokens(f"{label} {chunk['content']}")
+        if tokens > remaining:
+            if selected or remaining <= 0:
+                continue
+            # Never send an empty context: trim the best chunk to fit
+            chunk["content"] = _truncate_tokens(chunk["content"], max(1, remaining - count_tokens(label) - 1))
+            tokens = count_tokens(f"{label} {chunk['content']}")
+        chunk["token_count"] = tokens
+        selected.append(chunk)
+        remaining -= tokens
+
+    context, retrieved_chunks = [], []
+    for i, chunk in enumerate(selected, start=1):
+        source_label, label = _label(i, chunk["metadata"])
+        context.append(f"{label} {chunk['content']}")
+        retrieved_chunks.append({
+            "label": source_label,
+            "content": chunk["content"],
+            "metadata": chunk["metadata"],
+            "score": chunk["score"],
+            "token_count": chunk["token_count"],
+        })
+
+    return {
+        "context": context,
+        "retrieved_chunks": retrieved_chunks,
+        "log_context": log_context,
+        "token_counts": {
+            "context": sum(c["token_count"] for c in selected),
+            "log": log_tokens,
+            "budget": token_budget,
+            "candidate_chunks": candidates,
+            "selected_chunks": len(selected),
+        },
+    }
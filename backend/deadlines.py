@@ -0,0 +1,99 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Optional
+
+# Shared pool for LLM attempts. Abandoned attempts that already started (timed
+# out or beaten by a hedge) cannot be cancelled mid-request; the LLM clients'
+# own request timeouts bound how long they hold a pool thread.
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-call")
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage or the overall request budget runs out."""
+
+class Deadline:
+    """Monotonic time budget for one request."""
+
+    def __init__(self, budget_seconds: float):
+        self.expires_at = time.monotonic() + budget_seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+class LatencyTracker:
+    """Rolling window of successful call latencies, used to pick the hedge delay."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Latency at pct, or None until enough samples have been seen."""
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def call_with_deadline(fn: Callable[[], Any], timeout: float, hedge_after: Optional[float] = None,
+                       max_attempts: int = 2, tracker: Optional[LatencyTracker] = None) -> Any:
+    """
+    Runs fn() with a hard timeout, hedging and retrying within it.
+
+    If the first attempt hasn't finished after hedge_after seconds a duplicate
+    is started and the first successful result wins. A failed attempt is
+    retried immediately while attempts and time remain. Raises
+    DeadlineExceeded when the timeout passes without a result, or re-raises
+    the last error when every attempt failed.
+    """
+    if timeout <= 0:
+        raise DeadlineExceeded("No time left in the request budget")
+
+    start = time.monotonic()
+    expires_at = start + timeout
+    pending = {_executor.submit(fn)}
+    attempts = 1
+    last_error: Optional[BaseException] = None
+
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= expires_at:
+                raise DeadlineExceeded(f"Call exceeded its {timeout:.1f}s deadline")
+
+            wait_for = expires_at - now
+            can_hedge = hedge_after is not None and attempts < max_attempts
+            if can_hedge:
+                wait_for = min(wait_for, max(0.0, start + hedge_after - now))
+
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if tracker is not None:
+                        tracker.record(time.monotonic() - start)
+                    return future.result()
+                last_error = future.exception()
+
+            if not done and can_hedge and time.monotonic() >= start + hedge_after:
+                print(f"DEBUG: Hedging slow LLM call after {hedge_after:.2f}s")
+                pending.add(_executor.submit(fn))
+                attempts += 1
+            elif done and not pending:
+                if attempts >= max_attempts:
+                    raise last_error
+                pending.add(_executor.submit(fn))
+                attempts += 1
+    finally:
+        # Attempts still queued behind a busy pool must not reach the LLM once
+        # the caller has its answer; ones already running finish in the background
+        for future in pending:
+            future.cancel()
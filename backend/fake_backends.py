@@ -0,0 +1,121 @@
+import re
+import json
+import random
+import time
+import hashlib
+import threading
+from typing import Any, List, Optional
+import numpy as np
+from pydantic import PrivateAttr
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+CATEGORY_KEYWORDS = [
+    ("Malicious/Jailbreak", ["redacted_security_pattern", "jailbreak", "system prompt"]),
+    ("Ransomware", ["ransomware", "encrypt", "locked"]),
+    ("Brute Force", ["brute force", "ssh", "login attempts", "password"]),
+    ("Phishing", ["phishing", "email", "credential harvest"]),
+    ("Malware", ["malware", "trojan", "beacon"]),
+]
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic hashed bag-of-words embeddings with configurable latency.
+
+    Texts sharing vocabulary get similar vectors, so the semantic cache and
+    vector search behave roughly like they do with real embeddings.
+    """
+
+    def __init__(self, dim: int = 256, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.call_count = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str) -> List[float]:
+        vec = np.zeros(self.dim)
+        for token in re.findall(r"[a-z0-9]+", text.lower()):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vec[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            vec[0] = 1.0
+            norm = 1.0
+        return (vec / norm).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.call_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic stand-in for ChatOpenAI with configurable latency.
+
+    Answers the classify prompt with a keyword-matched category and the
+    respond prompt with a JSON report citing every [Source X] label it was given.
+    A seeded fraction `slow_rate` of calls takes `slow_latency` instead, to
+    simulate a provider with a heavy latency tail.
+    """
+
+    latency: float = 0.0
+    slow_rate: float = 0.0
+    slow_latency: float = 0.0
+    seed: int = 0
+    model_name: str = "fake-chat"
+    _call_count: int = PrivateAttr(default=0)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _rng: Any = PrivateAttr(default=None)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def call_count(self) -> int:
+        return self._call_count
+
+    def _classify(self, prompt: str) -> str:
+        text = prompt.lower()
+        for category, keywords in CATEGORY_KEYWORDS:
+            if any(keyword in text for keyword in keywords):
+                return category
+        return "General"
+
+    def _report(self, prompt: str) -> str:
+        labels = sorted(set(re.findall(r"\[(Source \d+)", prompt)), key=lambda s: int(s.split()[1]))
+        report = {
+            "classification": self._classify(prompt.split("investigation report for the query:")[-1]),
+            "findings": [f"Context reviewed from [{label}]" for label in labels] or ["No context provided."],
+            "suggested_next_steps": [f"Follow the playbook steps in [{label}]" for label in labels[:2]],
+            "references": labels,
+        }
+        return json.dumps(report)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        with self._lock:
+            self._call_count += 1
+            if self._rng is None:
+                self._rng = random.Random(self.seed)
+            slow = self.slow_rate and self._rng.random() < self.slow_rate
+        delay = self.slow_latency if slow else self.latency
+        if delay:
+            time.sleep(delay)
+        prompt = messages[-1].content
+        if "Classify the following" in prompt:
+            content = self._classify(prompt.split("Categories:")[0])
+        else:
+            content = self._report(prompt)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
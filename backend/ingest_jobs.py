@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+from rag_engine import RAGEngine, IngestCancelled
+
+TERMINAL_STATES = ("completed", "failed", "cancelled")
+# A job whose status file hasn't been updated for this long belongs to a worker that died
+STALE_AFTER_SECONDS = 300
+MAX_JOB_HISTORY = 50
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+class IngestJobManager:
+    """
+    Runs knowledge-base ingestion as background jobs.
+
+    Each job's status lives in <jobs_dir>/<job_id>.json, written atomically,
+    so any uvicorn worker can report progress for a job started by another.
+    Cancellation is a <job_id>.cancel marker that the running job polls
+    between batches. Only one job runs at a time across all workers: the
+    running job holds an exclusive flock on <jobs_dir>/ingest.lock, which
+    the OS releases if its worker dies.
+    """
+
+    def __init__(self, rag_engine: RAGEngine, jobs_dir: str = "../data/ingest_jobs"):
+        self.rag_engine = rag_engine
+        self.jobs_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), jobs_dir))
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, job_id: str, suffix: str = ".json") -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}{suffix}")
+
+    def _write(self, job: Dict):
+        job["updated_at"] = time.time()
+        tmp = self._path(job["job_id"], f".json.tmp-{os.getpid()}-{threading.get_ident()}")
+        with open(tmp, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp, self._path(job["job_id"]))
+
+    def _read(self, job_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _all_jobs(self) -> List[Dict]:
+        jobs = [self._read(name[:-5]) for name in os.listdir(self.jobs_dir) if name.endswith(".json")]
+        return sorted((job for job in jobs if job), key=lambda job: job["created_at"], reverse=True)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        if not _JOB_ID.match(job_id):
+            return None
+        job = self._read(job_id)
+        if job is not None and job["status"] not in TERMINAL_STATES and time.time() - job["updated_at"] >= STALE_AFTER_SECONDS:
+            # The worker running it died; without this the job would poll as running forever
+            job.update(status="failed", eta_seconds=None, error="worker exited",
+                       finished_at=datetime.utcnow().isoformat())
+            self._write(job)
+        if job is not None:
+            job["cancel_requested"] = os.path.exists(self._path(job_id, ".cancel"))
+        return job
+
+    def active_job(self) -> Optional[Dict]:
+        """The queued or running job, if any; jobs abandoned by a dead worker are ignored."""
+        for job in self._all_jobs():
+            if job["status"] not in TERMINAL_STATES and time.time() - job["updated_at"] < STALE_AFTER_SECONDS:
+                return job
+        return None
+
+    def _acquire_job_lock(self) -> Optional[int]:
+        """Takes the cross-process job lock without blocking; returns its fd, or None if held."""
+        fd = os.open(os.path.join(self.jobs_dir, "ingest.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def start(self, requested_by: str) -> Dict:
+        """Queues a new ingestion and runs it on a background thread."""
+        with self._lock:
+            lock_fd = self._acquire_job_lock()
+            if lock_fd is None:
+                active = self.active_job()
+                if active:
+                    raise RuntimeError(f"Ingest job {active['job_id']} is already {active['status']}")
+                raise RuntimeError("Another ingest job is already running")
+            job = {
+                "job_id": uuid.uuid4().hex,
+                "status": "queued",
+                "stage": None,
+                "requested_by": requested_by,
+                "created_at": datetime.utcnow().isoformat(),
+                "started_at": None,
+                "finished_at": None,
+                "files_total": None,
+                "files_parsed": 0,
+                "chunks_total": None,
+                "chunks_embedded": 0,
+                "eta_seconds": None,
+                "kb_version": None,
+                "error": None,
+            }
+            try:
+                self._write(job)
+                self._prune()
+                queued = dict(job)
+                threading.Thread(target=self._run, args=(job, lock_fd), name=f"ingest-{job['job_id'][:8]}", daemon=True).start()
+            except BaseException:
+                os.close(lock_fd)
+                raise
+        return queued
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Requests cancellation; the live index is untouched unless the job already completed."""
+        job = self.get(job_id)
+        if job is None or job["status"] in TERMINAL_STATES:
+            return job
+        open(self._path(job_id, ".cancel"), "w").close()
+        job["cancel_requested"] = True
+        return job
+
+    def _run(self, job: Dict, lock_fd: int):
+        job_id = job["job_id"]
+        job.update(status="running", started_at=datetime.utcnow().isoformat())
+        self._write(job)
+        embed_started = None
+
+        def progress(stage: str, **counts):
+            nonlocal embed_started
+            job["stage"] = stage
+            job.update(counts)
+            if stage == "embedding":
+                now = time.monotonic()
+                if embed_started is None:
+                    embed_started = now
+                done, total = job["chunks_embedded"], job["chunks_total"]
+                if done:
+                    job["eta_seconds"] = round((total - done) * (now - embed_started) / done, 1)
+            self._write(job)
+
+        try:
+            self.rag_engine.ingest_documents(
+                progress=progress,
+                should_cancel=lambda: os.path.exists(self._path(job_id, ".cancel"))
+            )
+            job.update(status="completed", eta_seconds=0, kb_version=self.rag_engine.kb_version())
+        except IngestCancelled:
+            print(f"DEBUG: Ingest job {job_id} cancelled")
+            job.update(status="cancelled", eta_seconds=None)
+        except Exception as e:
+            print(f"DEBUG: Ingest job {job_id} failed: {e}")
+            job.update(status="failed", eta_seconds=None, error=str(e))
+        finally:
+            try:
+                os.remove(self._path(job_id, ".cancel"))
+            except FileNotFoundError:
+                pass
+            # Release the job lock before publishing the terminal status, so a
+            # client that sees "completed" can start the next job straight away
+            os.close(lock_fd)
+            job["finished_at"] = datetime.utcnow().isoformat()
+            self._write(job)
+
+    def _prune(self):
+        """Keeps the status of the most recent MAX_JOB_HISTORY jobs."""
+        for job in self._all_jobs()[MAX_JOB_HISTORY:]:
+            if job["status"] in TERMINAL_STATES:
+                os.remove(self._path(job["job_id"]))
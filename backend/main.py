@@ -6,24 +6,35 @@ from auth import Token, User, get_current_user, create_access_token, verify_pass
 from audit_logger import log_incident_query, get_audit_logs
 from agent import IncidentAgent
 from rag_engine import RAGEngine
+from ingest_jobs import IngestJobManager
 import os
 from dotenv import load_dotenv
 from datetime import timedelta
+from contextlib import asynccontextmanager
 from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+from rate_limiter import rate_limit_key, endpoint_limit, storage_uri
 from starlette.requests import Request
+from starlette.concurrency import run_in_threadpool
 
 # Load environment before local imports
 load_dotenv(os.path.join(os.path.dirname(__file__), "../.env"))
 
-app = FastAPI(title="Secure Incident Investigator API")
-limiter = Limiter(key_func=get_remote_address)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Flush queued cache writes before the worker exits
+    agent.close()
+
+app = FastAPI(title="Secure Incident Investigator API", lifespan=lifespan)
+# Budgets are keyed by user and role and shared by every worker through storage_uri()
+limiter = Limiter(key_func=rate_limit_key, storage_uri=storage_uri())
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
 rag_engine = RAGEngine()
 agent = IncidentAgent()
+ingest_jobs = IngestJobManager(rag_engine)
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,7 +56,7 @@ async def health_check():
     return {"status": "healthy"}
 
 @app.post("/login", response_model=Token)
-@limiter.limit("10/minute")
+@limiter.limit(endpoint_limit("login"))
 async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
     user_dict = USERS_DB.get(form_data.username)
     if not user_dict or not verify_password(form_data.password, user_dict["password_hash"]):
@@ -62,32 +73,57 @@ async def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
 
 @app.post("/query")
-@limiter.limit("5/minute")
+@limiter.limit(endpoint_limit("query"))
 async def query_endpoint(request: Request, query_data: QueryRequest, current_user: User = Depends(get_current_user)):
     try:
-        result = agent.run(query_data.query, role=current_user.role)
+        # Run in the threadpool so concurrent queries overlap and can be coalesced
+        result = await run_in_threadpool(agent.run, query_data.query, role=current_user.role)
         return {
             "query": query_data.query,
             "classification": result["classification"],
             "report": result["report"],
-            "sources": result["sources"]
+            "sources": result["sources"],
+            "token_usage": result.get("token_usage", {}),
+            # Stages that fell back after running out of time; check report.llm_generated for the report itself
+            "degraded": result.get("degraded", [])
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/ingest")
-@limiter.limit("2/minute")
+@app.post("/ingest", status_code=status.HTTP_202_ACCEPTED)
+@limiter.limit(endpoint_limit("ingest"))
 async def ingest_endpoint(request: Request, current_user: User = Depends(check_admin_role)):
+    # Runs in the background into a new index; queries keep using the live one until it completes
     try:
-        rag_engine.ingest_documents()
-        return {"message": "Documents ingested successfully"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return ingest_jobs.start(requested_by=current_user.username)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+@app.get("/ingest/{job_id}")
+async def ingest_status_endpoint(job_id: str, current_user: User = Depends(check_admin_role)):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Ingest job not found")
+    return job
+
+@app.delete("/ingest/{job_id}")
+async def ingest_cancel_endpoint(job_id: str, current_user: User = Depends(check_admin_role)):
+    job = ingest_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Ingest job not found")
+    if not job.get("cancel_requested"):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Ingest job already {job['status']}")
+    return job
 
 @app.get("/audit")
 async def audit_endpoint(current_user: User = Depends(check_admin_role)):
     return get_audit_logs()
 
+@app.get("/metrics")
+async def metrics_endpoint(current_user: User = Depends(check_admin_role)):
+    # Per-worker counters; each uvicorn worker reports its own
+    return agent.metrics()
+
 @app.get("/history")
 async def history_endpoint(current_user: User = Depends(get_current_user)):
     # Returns the last 10 investigations
@@ -1,87 +1,188 @@
 import os
 import json
-from typing import List
+import uuid
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
 from langchain_community.document_loaders import DirectoryLoader, TextLoader, UnstructuredMarkdownLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_core.documents import Document
+from chunking import split_documents
+from vector_snapshot import VectorSnapshot
 from dotenv import load_dotenv
 
 load_dotenv()
 
+DEFAULT_COLLECTION = "langchain"
+ACTIVE_COLLECTION_FILE = "ACTIVE_COLLECTION"
+
+class IngestCancelled(Exception):
+    """Raised when an ingestion is cancelled before it was activated."""
+
 class RAGEngine:
-    def __init__(self, data_dir: str = "../data/knowledge", persist_dir: str = "../data/chroma"):
+    def __init__(self, data_dir: str = "../data/knowledge", persist_dir: str = "../data/chroma", embeddings=None,
+                 chunking: str = "structured", snapshot_dir: str = "../data/snapshot"):
         self.data_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), data_dir))
         self.persist_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), persist_dir))
-        self.embeddings = OpenAIEmbeddings()
+        # Queries are served from the memory-mapped snapshot when one exists, else from Chroma
+        self.snapshot_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), snapshot_dir)) if snapshot_dir else None
+        self.snapshot_dtype = os.getenv("SNAPSHOT_DTYPE", "int8")
+        self.snapshot_rescore = os.getenv("SNAPSHOT_RESCORE", "true").lower() == "true"
+        self.snapshot = None
+        self.embeddings = embeddings or OpenAIEmbeddings()
+        # "structured" splits per playbook record/phase and markdown section;
+        # "recursive" is the original fixed-size splitter, kept for comparison
+        self.chunking = chunking
         self.vector_store = None
-        
-    def ingest_documents(self):
-        """Loads documents from the data directory and stores them in the vector store."""
-        
-        all_docs = []
-        
-        # 1. Walk through subdirectories for categorized ingestion
-        for root, dirs, files in os.walk(self.data_dir):
+        self._vector_store_collection = None
+        self.ingest_batch_size = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+
+    def _source_files(self) -> List[Tuple[str, str]]:
+        """(path, category) for every ingestible file under the data directory."""
+        files = []
+        for root, dirs, names in os.walk(self.data_dir):
             category = os.path.basename(root) if root != self.data_dir else "general"
-            
-            for file in files:
-                full_path = os.path.join(root, file)
-                
-                # Load Markdown files
-                if file.endswith(".md"):
-                    try:
-                        loader = TextLoader(full_path)
-                        docs = loader.load()
-                        for doc in docs:
-                            doc.metadata["category"] = category
-                            doc.metadata["doc_id"] = file
-                            doc.metadata["page_number"] = 1
-                            doc.metadata["clause_id"] = "N/A"
-                            doc.metadata["version"] = "1.0"
-                            doc.metadata["source_url"] = f"file://{full_path}"
-                        all_docs.extend(docs)
-                    except Exception as e:
-                        print(f"Error loading {file}: {e}")
-                
-                # Load JSONL and JSON files
-                elif file.endswith(".jsonl"):
-                    with open(full_path, 'r', encoding='utf-8') as f:
-                        for line in f:
-                            if line.strip():
-                                try:
-                                    data = json.loads(line)
-                                    doc = self._parse_playbook_json(data, full_path, category)
-                                    all_docs.append(doc)
-                                except Exception as e:
-                                    print(f"Error parsing line in {file}: {e}")
-                                    
-                elif file.endswith(".json") and not file.endswith("audit_log.json"):
-                    with open(full_path, 'r', encoding='utf-8') as f:
+            for file in sorted(names):
+                if file.endswith((".md", ".jsonl")) or (file.endswith(".json") and not file.endswith("audit_log.json")):
+                    files.append((os.path.join(root, file), category))
+        return files
+
+    def _load_file(self, full_path: str, category: str) -> List[Document]:
+        """Parses one knowledge file into documents with enriched metadata."""
+        file = os.path.basename(full_path)
+        docs = []
+
+        # Load Markdown files
+        if file.endswith(".md"):
+            try:
+                loader = TextLoader(full_path)
+                docs = loader.load()
+                for doc in docs:
+                    doc.metadata["category"] = category
+                    doc.metadata["doc_id"] = file
+                    doc.metadata["page_number"] = 1
+                    doc.metadata["clause_id"] = "N/A"
+                    doc.metadata["version"] = "1.0"
+                    doc.metadata["source_url"] = f"file://{full_path}"
+            except Exception as e:
+                print(f"Error loading {file}: {e}")
+
+        # Load JSONL and JSON files
+        elif file.endswith(".jsonl"):
+            with open(full_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
                         try:
-                            data = json.load(f)
-                            if isinstance(data, list):
-                                for item in data:
-                                    all_docs.append(self._parse_playbook_json(item, full_path, category))
-                            else:
-                                all_docs.append(self._parse_playbook_json(data, full_path, category))
+                            data = json.loads(line)
+                            docs.append(self._parse_playbook_json(data, full_path, category))
                         except Exception as e:
-                            print(f"Error parsing {file}: {e}")
+                            print(f"Error parsing line in {file}: {e}")
+
+        elif file.endswith(".json"):
+            with open(full_path, 'r', encoding='utf-8') as f:
+                try:
+                    data = json.load(f)
+                    if isinstance(data, list):
+                        for item in data:
+                            docs.append(self._parse_playbook_json(item, full_path, category))
+                    else:
+                        docs.append(self._parse_playbook_json(data, full_path, category))
+                except Exception as e:
+                    print(f"Error parsing {file}: {e}")
+        return docs
+
+    def _split(self, docs: List[Document]) -> Tuple[List[Document], Optional[List[str]]]:
+        if self.chunking == "structured":
+            splits = split_documents(docs, base_dir=self.data_dir)
+            return splits, [doc.metadata["chunk_id"] for doc in splits]
+        # start_index lets the context builder merge overlapping neighbours at query time
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, add_start_index=True)
+        return text_splitter.split_documents(docs), None
+
+    def ingest_documents(self, progress: Callable = None, should_cancel: Callable[[], bool] = None):
+        """
+        Loads documents from the data directory into a fresh, versioned collection.
+
+        Readers keep using the live collection and snapshot until the new ones
+        are complete, then are switched over atomically. progress(stage, **counts)
+        is called as files are parsed and chunks embedded. should_cancel() is
+        polled between steps; cancelling raises IngestCancelled and drops the
+        partial build without touching the live index.
+        """
+        report = progress or (lambda stage, **counts: None)
+
+        def check_cancel():
+            if should_cancel and should_cancel():
+                raise IngestCancelled("Ingestion cancelled")
+
+        # 1. Walk through subdirectories for categorized ingestion
+        files = self._source_files()
+        all_docs = []
+        report("parsing", files_total=len(files), files_parsed=0)
+        for i, (full_path, category) in enumerate(files, start=1):
+            check_cancel()
+            all_docs.extend(self._load_file(full_path, category))
+            report("parsing", files_total=len(files), files_parsed=i)
 
         if not all_docs:
             print("No documents found to ingest.")
-            return
+            return 0
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        splits = text_splitter.split_documents(all_docs)
-        
-        self.vector_store = Chroma.from_documents(
-            documents=splits,
-            embedding=self.embeddings,
-            persist_directory=self.persist_dir
+        # 2. Chunk and embed into a new collection in batches
+        splits, ids = self._split(all_docs)
+        collection = f"kb_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        store = Chroma(collection_name=collection, embedding_function=self.embeddings, persist_directory=self.persist_dir)
+        snapshot = None
+        try:
+            report("embedding", chunks_total=len(splits), chunks_embedded=0)
+            for start in range(0, len(splits), self.ingest_batch_size):
+                check_cancel()
+                end = start + self.ingest_batch_size
+                store.add_documents(splits[start:end], ids=ids[start:end] if ids else None)
+                report("embedding", chunks_total=len(splits), chunks_embedded=min(end, len(splits)))
+
+            if self.snapshot_dir:
+                check_cancel()
+                report("snapshot")
+                snapshot = self._export_snapshot(store, activate=False)
+            check_cancel()
+        except BaseException:
+            store.delete_collection()
+            raise
+
+        # 3. Switch readers over: snapshot first (the query path), then the Chroma fallback
+        previous_snapshot = VectorSnapshot.current_version(self.snapshot_dir) if snapshot else None
+        previous_collection = self.active_collection()
+        if snapshot:
+            VectorSnapshot.activate(self.snapshot_dir, snapshot.version)
+            self.snapshot = snapshot
+            VectorSnapshot.prune(self.snapshot_dir, keep={snapshot.version, previous_snapshot})
+        self._activate_collection(collection)
+        self.vector_store, self._vector_store_collection = store, collection
+        self._drop_collections(keep={collection, previous_collection})
+
+        print(f"Ingested {len(splits)} document chunks into collection {collection}.")
+        return len(splits)
+
+    def export_snapshot(self):
+        """Exports the live Chroma collection to a quantized, memory-mapped snapshot and activates it."""
+        self.snapshot = self._export_snapshot(self._load_vector_store(), activate=True)
+
+    def _export_snapshot(self, store, activate: bool) -> VectorSnapshot:
+        data = store.get(include=["embeddings", "documents", "metadatas"])
+        snapshot = VectorSnapshot.export(
+            self.snapshot_dir,
+            embeddings=data["embeddings"],
+            texts=data["documents"],
+            metadatas=data["metadatas"],
+            dtype=self.snapshot_dtype,
+            # The float32 copy is only read for re-scoring
+            keep_full_precision=self.snapshot_rescore,
+            activate=activate
         )
-        print(f"Ingested {len(splits)} document chunks.")
+        print(f"Exported vector snapshot {snapshot.version} ({len(snapshot)} chunks, {self.snapshot_dtype}).")
+        return snapshot
 
     def _parse_playbook_json(self, data: dict, source_path: str, category: str = "playbook") -> Document:
         """Converts a playbook JSON object into a readable text document with enriched metadata."""
@@ -132,15 +233,67 @@ class RAGEngine:
             }
         )
 
-    def query(self, query: str, k: int = 3):
-        """Retrieves relevant document chunks for a given query."""
-        if not self.vector_store:
+    def active_collection(self) -> str:
+        """Name of the Chroma collection readers should use; indexes built before versioning used the default."""
+        try:
+            with open(os.path.join(self.persist_dir, ACTIVE_COLLECTION_FILE)) as f:
+                return f.read().strip() or DEFAULT_COLLECTION
+        except FileNotFoundError:
+            return DEFAULT_COLLECTION
+
+    def _activate_collection(self, collection: str):
+        os.makedirs(self.persist_dir, exist_ok=True)
+        tmp = os.path.join(self.persist_dir, f"{ACTIVE_COLLECTION_FILE}.tmp-{os.getpid()}")
+        with open(tmp, "w") as f:
+            f.write(collection)
+        os.replace(tmp, os.path.join(self.persist_dir, ACTIVE_COLLECTION_FILE))
+
+    def _drop_collections(self, keep: set):
+        """Deletes superseded collections, keeping the live one and its predecessor for in-flight readers."""
+        client = self.vector_store._client
+        for item in client.list_collections():
+            name = getattr(item, "name", item)
+            if name not in keep:
+                client.delete_collection(name)
+
+    def _load_vector_store(self):
+        """Returns the live collection, reopening it if another process swapped versions."""
+        collection = self.active_collection()
+        if not self.vector_store or self._vector_store_collection not in (None, collection):
             self.vector_store = Chroma(
+                collection_name=collection,
                 persist_directory=self.persist_dir, 
                 embedding_function=self.embeddings
             )
-        
-        return self.vector_store.similarity_search(query, k=k)
+            self._vector_store_collection = collection
+        return self.vector_store
+
+    def _current_snapshot(self):
+        """Returns the active snapshot, reopening it if another process swapped versions."""
+        if not self.snapshot_dir:
+            return None
+        version = VectorSnapshot.current_version(self.snapshot_dir)
+        if version is None:
+            return None
+        if self.snapshot is None or self.snapshot.version != version:
+            self.snapshot = VectorSnapshot.open_current(self.snapshot_dir)
+        return self.snapshot
+
+    def kb_version(self) -> str:
+        """Identifies the knowledge base answers are built from; changes on every re-ingest."""
+        snapshot = self._current_snapshot()
+        return snapshot.version if snapshot is not None else self.active_collection()
+
+    def query(self, query: str, k: int = 3):
+        """Retrieves relevant document chunks for a given query."""
+        return [doc for doc, _ in self.query_with_scores(query, k=k)]
+
+    def query_with_scores(self, query: str, k: int = 3):
+        """Retrieves relevant document chunks with relevance scores (higher is better)."""
+        snapshot = self._current_snapshot()
+        if snapshot is not None:
+            return snapshot.search(self.embeddings.embed_query(query), k=k, rescore=self.snapshot_rescore)
+        return self._load_vector_store().similarity_search_with_relevance_scores(query, k=k)
 
 if __name__ == "__main__":
     # Test script
@@ -0,0 +1,140 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Callable
+from jose import JWTError, jwt
+from limits.storage import Storage
+from slowapi.util import get_remote_address
+from starlette.requests import Request
+from auth import SECRET_KEY, ALGORITHM, USERS_DB
+
+DEFAULT_STORAGE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/ratelimit.db"))
+
+# Per-endpoint budgets, optionally per role. Override with RATE_LIMIT_<ENDPOINT>
+# or RATE_LIMIT_<ENDPOINT>_<ROLE>, e.g. RATE_LIMIT_QUERY_ADMIN="20/minute".
+DEFAULT_LIMITS = {
+    "login": {"default": "10/minute"},
+    "query": {"default": "5/minute"},
+    "ingest": {"default": "2/minute"},
+}
+
+class SQLiteStorage(Storage):
+    """
+    Fixed-window rate limit counters in a WAL-mode SQLite file.
+
+    Registered with `limits` under the ``sqlite://`` scheme so every uvicorn
+    worker on the host shares one budget, e.g. ``sqlite:////srv/ragbot/ratelimit.db``.
+    Multi-host deployments can point RATE_LIMIT_STORAGE_URI at ``redis://`` instead.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+    PURGE_EVERY = 1000
+
+    def __init__(self, uri: str = None, wrap_exceptions: bool = False, **options):
+        path = uri[len("sqlite://"):] if uri else ""
+        self.db_path = path or DEFAULT_STORAGE_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._local = threading.local()
+        self._incr_count = 0
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                count INTEGER NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit: each statement below is a single atomic upsert/read
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            """
+            INSERT INTO rate_limits (key, count, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                count = CASE WHEN rate_limits.expires_at <= ? THEN excluded.count ELSE rate_limits.count + excluded.count END,
+                expires_at = CASE WHEN rate_limits.expires_at <= ? THEN excluded.expires_at ELSE rate_limits.expires_at END
+            RETURNING count
+            """,
+            (key, amount, now + expiry, now, now),
+        ).fetchone()
+
+        self._incr_count += 1
+        if self._incr_count % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+        return row[0]
+
+    def get(self, key: str) -> int:
+        row = self._connection().execute(
+            "SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        row = self._connection().execute(
+            "SELECT expires_at FROM rate_limits WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self) -> bool:
+        try:
+            self._connection().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> int:
+        return self._connection().execute("DELETE FROM rate_limits").rowcount
+
+    def clear(self, key: str) -> None:
+        self._connection().execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+def storage_uri() -> str:
+    """Shared storage for the limiter; defaults to the SQLite file under data/."""
+    return os.getenv("RATE_LIMIT_STORAGE_URI", f"sqlite://{DEFAULT_STORAGE_PATH}")
+
+def rate_limit_key(request: Request) -> str:
+    """Keys authenticated requests by role and username, anonymous ones by client IP."""
+    auth_header = request.headers.get("Authorization", "")
+    scheme, _, token = auth_header.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user = USERS_DB.get(payload.get("sub"))
+            if user:
+                return f"user:{user['role']}:{user['username']}"
+        except JWTError:
+            pass
+    return f"ip:{get_remote_address(request)}"
+
+def endpoint_limit(endpoint: str) -> Callable[[str], str]:
+    """Returns a slowapi limit provider resolving the endpoint budget for the caller's role."""
+    defaults = DEFAULT_LIMITS.get(endpoint, {})
+    env_prefix = f"RATE_LIMIT_{endpoint.upper()}"
+
+    def provider(key: str) -> str:
+        kind, _, rest = key.partition(":")
+        role = rest.split(":", 1)[0] if kind == "user" else None
+        if role:
+            role_limit = os.getenv(f"{env_prefix}_{role.upper()}") or defaults.get(role)
+            if role_limit:
+                return role_limit
+        return os.getenv(env_prefix) or defaults.get("default", "60/minute")
+
+    return provider
@@ -0,0 +1,101 @@
+import copy
+import time
+import threading
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional
+
+class _Flight:
+    def __init__(self, query: str, vector: Optional[np.ndarray]):
+        self.query = query
+        self.vector = vector
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.finished_at: Optional[float] = None
+
+class RequestCoalescer:
+    """
+    Single-flight execution for concurrent investigations.
+
+    The first request for a query runs the pipeline; later requests in the
+    same partition (role and knowledge-base version) whose query matches
+    exactly, or whose embedding is within the semantic cache threshold, wait
+    for that run and share its result.
+    Successful, non-degraded results linger briefly to cover the write-behind
+    lag before they land in the semantic cache.
+    """
+
+    def __init__(self, threshold: float = 0.90, linger: float = 2.0):
+        self.threshold = threshold
+        self.linger = linger
+        self._lock = threading.Lock()
+        self._flights: Dict[str, List[_Flight]] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def _normalize(self, vector) -> Optional[np.ndarray]:
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float64)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _match(self, flights: List[_Flight], query: str, vector: Optional[np.ndarray]) -> Optional[_Flight]:
+        best, best_sim = None, self.threshold
+        for flight in flights:
+            if flight.query == query:
+                return flight
+            if vector is not None and flight.vector is not None:
+                sim = float(np.dot(vector, flight.vector))
+                if sim >= best_sim:
+                    best, best_sim = flight, sim
+        return best
+
+    @staticmethod
+    def _degraded(result) -> bool:
+        # Degraded answers are never cached, so they must not linger for later arrivals either
+        return isinstance(result, dict) and bool(result.get("degraded"))
+
+    def _prune(self, flights: List[_Flight]):
+        now = time.monotonic()
+        flights[:] = [f for f in flights if f.finished_at is None or now - f.finished_at < self.linger]
+
+    def run(self, query: str, partition: str, query_vector, fn: Callable[[], Any]) -> Any:
+        """Runs fn() once per group of matching in-flight queries within a partition."""
+        vector = self._normalize(query_vector)
+        with self._lock:
+            flights = self._flights.setdefault(partition, [])
+            self._prune(flights)
+            flight = self._match(flights, query, vector)
+            if flight is None:
+                flight = _Flight(query, vector)
+                flights.append(flight)
+                self.leaders += 1
+                leader = True
+            else:
+                self.followers += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            print(f"DEBUG: Coalesced query '{query}' onto in-flight '{flight.query}'")
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is not None or not self.linger or self._degraded(flight.result):
+                    self._flights[partition].remove(flight)
+                flight.finished_at = time.monotonic()
+            flight.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"leaders": self.leaders, "followers": self.followers}
@@ -0,0 +1,48 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from langchain_core.documents import Document
+from context_builder import assemble_context, count_tokens
+
+def _doc(text, doc_id, **meta):
+    return Document(page_content=text, metadata={"doc_id": doc_id, "source": f"{doc_id}.md", **meta})
+
+def test_sources_are_labelled_in_score_order():
+    scored = [
+        (_doc("Block the source IP at the firewall.", "ssh.md", version="2.0"), 0.4),
+        (_doc("Isolate the host from the network immediately.", "ransomware.md"), 0.9),
+    ]
+    result = assemble_context(scored, token_budget=500)
+    assert result["context"][0].startswith("[Source 1: ransomware.md v1.0] Isolate")
+    assert result["context"][1].startswith("[Source 2: ssh.md v2.0] Block")
+    assert [c["label"] for c in result["retrieved_chunks"]] == ["Source 1", "Source 2"]
+
+def test_labels_stay_contiguous_after_dropping_duplicates():
+    text = "Disable password based SSH login and use SSH keys for every account on the host."
+    scored = [
+        (_doc(text, "a.md"), 0.9),
+        (_doc(text, "b.md"), 0.8),
+        (_doc("Restore from offline backups after the environment is clean.", "c.md"), 0.7),
+    ]
+    result = assemble_context(scored, token_budget=500)
+    assert [c["label"] for c in result["retrieved_chunks"]] == ["Source 1", "Source 2"]
+    assert result["context"][1].startswith("[Source 2: c.md")
+
+def test_overlapping_chunks_of_a_document_are_merged():
+    text = "Step one: isolate. Step two: identify the variant. Step three: restore from backups."
+    scored = [
+        (_doc(text[:50], "r.md", start_index=0), 0.9),
+        (_doc(text[30:], "r.md", start_index=30), 0.8),
+    ]
+    result = assemble_context(scored, token_budget=500)
+    assert len(result["context"]) == 1
+    assert result["retrieved_chunks"][0]["content"] == text
+
+def test_context_fits_the_token_budget():
+    scored = [(_doc(f"Playbook {i} " + "containment step " * 40, f"doc{i}.md"), 1 - i / 10) for i in range(5)]
+    result = assemble_context(scored, log_context="failed logins " * 200, token_budget=300)
+    counts = result["token_counts"]
+    assert counts["log"] <= 150 + count_tokens("\n[truncated]")
+    assert counts["context"] + counts["log"] <= 300 + count_tokens("\n[truncated]")
+    assert counts["selected_chunks"] >= 1
@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import threading
+import pytest
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import deadlines
+from deadlines import Deadline, DeadlineExceeded, LatencyTracker, call_with_deadline
+
+class _Calls:
+    """fn for call_with_deadline whose n-th attempt sleeps/raises as scripted."""
+
+    def __init__(self, *behaviours):
+        self.behaviours = list(behaviours)
+        self.started = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            index = self.started
+            self.started += 1
+        delay, outcome = self.behaviours[min(index, len(self.behaviours) - 1)]
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+def test_fast_call_returns_without_hedging():
+    fn = _Calls((0.0, "first"))
+    assert call_with_deadline(fn, timeout=1.0, hedge_after=0.5) == "first"
+    assert fn.started == 1
+
+def test_hedge_wins_when_first_attempt_stalls():
+    fn = _Calls((1.0, "slow"), (0.0, "hedge"))
+    start = time.monotonic()
+    assert call_with_deadline(fn, timeout=2.0, hedge_after=0.05) == "hedge"
+    assert time.monotonic() - start < 0.5
+    assert fn.started == 2
+
+def test_timeout_raises_deadline_exceeded():
+    fn = _Calls((1.0, "slow"))
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        call_with_deadline(fn, timeout=0.1)
+    assert time.monotonic() - start < 0.5
+
+def test_no_budget_left_never_calls():
+    fn = _Calls((0.0, "never"))
+    with pytest.raises(DeadlineExceeded):
+        call_with_deadline(fn, timeout=0)
+    assert fn.started == 0
+
+def test_failed_attempt_is_retried_within_budget():
+    fn = _Calls((0.0, ValueError("rate limited")), (0.0, "retried"))
+    assert call_with_deadline(fn, timeout=1.0, max_attempts=2) == "retried"
+
+def test_last_error_is_raised_when_every_attempt_fails():
+    fn = _Calls((0.0, ValueError("boom")))
+    with pytest.raises(ValueError, match="boom"):
+        call_with_deadline(fn, timeout=1.0, max_attempts=2)
+    assert fn.started == 2
+
+def test_queued_attempts_are_cancelled_after_timeout(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(deadlines, "_executor", pool)
+    fn = _Calls((0.3, "slow"))
+    with pytest.raises(DeadlineExceeded):
+        call_with_deadline(fn, timeout=0.1, hedge_after=0.02)
+    pool.shutdown(wait=True)
+    # The hedge was queued behind the stalled call and must never have run
+    assert fn.started == 1
+
+def test_latency_tracker_needs_samples_before_hedging():
+    tracker = LatencyTracker(min_samples=5)
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        tracker.record(seconds)
+    assert tracker.percentile(95) is None
+    tracker.record(1.0)
+    assert tracker.percentile(95) == 1.0
+    assert tracker.percentile(50) == 0.3
+
+def test_successful_calls_are_tracked():
+    tracker = LatencyTracker(min_samples=1)
+    call_with_deadline(_Calls((0.0, "ok")), timeout=1.0, tracker=tracker)
+    assert tracker.percentile(50) is not None
+
+def test_deadline_remaining():
+    deadline = Deadline(0.05)
+    assert 0 < deadline.remaining() <= 0.05
+    time.sleep(0.06)
+    assert deadline.remaining() == 0 and deadline.expired()
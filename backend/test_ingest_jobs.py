@@ -0,0 +1,62 @@
+import os
+import json
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from ingest_jobs import IngestJobManager, TERMINAL_STATES, STALE_AFTER_SECONDS
+from rag_engine import IngestCancelled
+
+class _StubEngine:
+    """Stands in for RAGEngine; each ingest finishes after a short pause."""
+
+    def __init__(self, seconds=0.01):
+        self.seconds = seconds
+        self.runs = 0
+
+    def ingest_documents(self, progress=None, should_cancel=None):
+        progress("embedding", chunks_total=1, chunks_embedded=0)
+        time.sleep(self.seconds)
+        if should_cancel():
+            raise IngestCancelled()
+        self.runs += 1
+        progress("embedding", chunks_total=1, chunks_embedded=1)
+
+    def kb_version(self):
+        return f"v{self.runs}"
+
+def _wait_until_finished(jobs, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = jobs.get(job_id)
+        if job["status"] in TERMINAL_STATES:
+            return job
+        time.sleep(0.001)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+def test_next_job_can_start_as_soon_as_previous_reports_completed(tmp_path):
+    engine = _StubEngine()
+    jobs = IngestJobManager(engine, jobs_dir=str(tmp_path))
+    job_id = jobs.start(requested_by="admin")["job_id"]
+    for _ in range(20):
+        assert _wait_until_finished(jobs, job_id)["status"] == "completed"
+        # Must not raise "already running" once the status says completed
+        job_id = jobs.start(requested_by="admin")["job_id"]
+    _wait_until_finished(jobs, job_id)
+    assert engine.runs == 21
+
+def test_job_abandoned_by_dead_worker_is_reported_failed(tmp_path):
+    jobs = IngestJobManager(_StubEngine(), jobs_dir=str(tmp_path))
+    job = {"job_id": "0" * 32, "status": "running", "created_at": "2024-01-01T00:00:00",
+           "finished_at": None, "eta_seconds": 12.0, "error": None,
+           "updated_at": time.time() - STALE_AFTER_SECONDS - 1}
+    with open(jobs._path(job["job_id"]), "w") as f:
+        json.dump(job, f)
+
+    reported = jobs.get(job["job_id"])
+    assert reported["status"] == "failed"
+    assert reported["error"] == "worker exited"
+    assert jobs._read(job["job_id"])["status"] == "failed"
+    # Nothing left to cancel, so no marker is written
+    assert jobs.cancel(job["job_id"])["cancel_requested"] is False
+    assert not os.path.exists(jobs._path(job["job_id"], ".cancel"))
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from request_coalescer import RequestCoalescer
+
+def _run_concurrently(calls):
+    """Starts every (coalescer, query, partition, fn) call at once and returns results in order."""
+    results = [None] * len(calls)
+    barrier = threading.Barrier(len(calls))
+
+    def worker(i, coalescer, query, partition, fn):
+        barrier.wait()
+        results[i] = coalescer.run(query, partition, None, fn)
+
+    threads = [threading.Thread(target=worker, args=(i, *call)) for i, call in enumerate(calls)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def test_followers_share_the_leader_result():
+    coalescer = RequestCoalescer()
+    calls = []
+
+    def investigate():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"report": "shared", "degraded": []}
+
+    results = _run_concurrently([(coalescer, "ransomware on server 01", "analyst:v1", investigate)] * 4)
+    assert len(calls) == 1
+    assert all(r == {"report": "shared", "degraded": []} for r in results)
+    assert coalescer.stats() == {"leaders": 1, "followers": 3}
+
+def test_roles_never_share_results():
+    coalescer = RequestCoalescer()
+
+    def investigate_as(role):
+        def fn():
+            time.sleep(0.2)
+            return {"report": f"{role} report", "degraded": []}
+        return fn
+
+    results = _run_concurrently([
+        (coalescer, "ransomware on server 01", "admin:v1", investigate_as("admin")),
+        (coalescer, "ransomware on server 01", "analyst:v1", investigate_as("analyst")),
+        (coalescer, "ransomware on server 01", "analyst:v1", investigate_as("analyst")),
+    ])
+    assert results[0]["report"] == "admin report"
+    assert results[1]["report"] == results[2]["report"] == "analyst report"
+
+    # A lingering admin result must not be handed to a later analyst either
+    late = coalescer.run("ransomware on server 01", "analyst:v2", None, investigate_as("analyst"))
+    assert late["report"] == "analyst report"
+
+def test_semantic_match_is_scoped_to_partition():
+    coalescer = RequestCoalescer(threshold=0.9)
+    coalescer.run("ransomware on server 01", "admin:v1", [1.0, 0.0], lambda: {"report": "admin", "degraded": []})
+    result = coalescer.run("Ransomware on server 01?", "analyst:v1", [1.0, 0.0], lambda: {"report": "analyst", "degraded": []})
+    assert result["report"] == "analyst"
+
+def test_successful_result_lingers_but_degraded_does_not():
+    coalescer = RequestCoalescer(linger=5.0)
+    coalescer.run("q", "admin:v1", None, lambda: {"report": "ok", "degraded": []})
+    assert coalescer.run("q", "admin:v1", None, lambda: {"report": "new", "degraded": []})["report"] == "ok"
+
+    coalescer.run("slow", "admin:v1", None, lambda: {"report": "fallback", "degraded": ["respond"]})
+    assert coalescer.run("slow", "admin:v1", None, lambda: {"report": "fresh", "degraded": []})["report"] == "fresh"
+
+def test_leader_error_reaches_followers_and_is_not_kept():
+    coalescer = RequestCoalescer()
+
+    def fail():
+        time.sleep(0.1)
+        raise RuntimeError("LLM unavailable")
+
+    errors = []
+
+    def worker():
+        try:
+            coalescer.run("q", "admin:v1", None, fail)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == ["LLM unavailable"] * 3
+    assert coalescer.run("q", "admin:v1", None, lambda: "recovered") == "recovered"
@@ -0,0 +1,34 @@
+import os
+import sys
+import multiprocessing
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+
+from limits import parse
+from limits.strategies import FixedWindowRateLimiter
+from rate_limiter import SQLiteStorage, endpoint_limit
+
+def _hit_worker(uri: str, hits: int) -> int:
+    limiter = FixedWindowRateLimiter(SQLiteStorage(uri))
+    limit = parse("50/minute")
+    return sum(limiter.hit(limit, "user:analyst:alice") for _ in range(hits))
+
+def test_budget_is_shared_across_processes(tmp_path):
+    uri = f"sqlite://{tmp_path / 'ratelimit.db'}"
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        allowed = pool.starmap(_hit_worker, [(uri, 30)] * 4)
+    assert sum(allowed) == 50
+
+def test_budgets_are_separate_per_key(tmp_path):
+    limiter = FixedWindowRateLimiter(SQLiteStorage(f"sqlite://{tmp_path / 'ratelimit.db'}"))
+    limit = parse("2/minute")
+    assert [limiter.hit(limit, "user:admin:admin") for _ in range(3)] == [True, True, False]
+    assert limiter.hit(limit, "user:analyst:alice")
+
+def test_endpoint_limit_resolves_role_overrides(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_QUERY_ADMIN", "20/minute")
+    monkeypatch.delenv("RATE_LIMIT_QUERY", raising=False)
+    provider = endpoint_limit("query")
+    assert provider("user:admin:admin") == "20/minute"
+    assert provider("user:analyst:alice") == "5/minute"
+    assert provider("ip:10.0.0.1") == "5/minute"
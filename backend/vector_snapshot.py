@@ -0,0 +1,187 @@
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime
+from typing import List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+
+CURRENT_FILE = "CURRENT"
+SEARCH_BLOCK_ROWS = 2048
+
+def _write_blob(path: str, items: List[bytes]) -> np.ndarray:
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    with open(path, "wb") as f:
+        for i, item in enumerate(items):
+            f.write(item)
+            offsets[i + 1] = offsets[i] + len(item)
+    return offsets
+
+def _load(path: str):
+    return np.load(path, mmap_mode="r")
+
+class VectorSnapshot:
+    """
+    Compact, read-only copy of the vector index for query serving.
+
+    Vectors are L2-normalised and stored quantised (int8 with a per-row scale,
+    or float16) next to an optional float32 copy for exact re-scoring. Chunk
+    texts and metadata live in flat blobs addressed by offset arrays. Every
+    file is opened with mmap, so all workers on a host share one copy through
+    the page cache instead of each holding the index on its own heap.
+
+    Layout: <root>/<version>/{manifest.json, vectors.npy, scales.npy,
+    vectors_f32.npy, texts.bin, text_offsets.npy, meta.bin, meta_offsets.npy}
+    with <root>/CURRENT naming the live version.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest["version"]
+        self.vectors = _load(os.path.join(path, "vectors.npy"))
+        self.scales = _load(os.path.join(path, "scales.npy")) if self.manifest["dtype"] == "int8" else None
+        full_path = os.path.join(path, "vectors_f32.npy")
+        self.full_vectors = _load(full_path) if os.path.exists(full_path) else None
+        self.texts = np.memmap(os.path.join(path, "texts.bin"), dtype=np.uint8, mode="r")
+        self.text_offsets = _load(os.path.join(path, "text_offsets.npy"))
+        self.meta = np.memmap(os.path.join(path, "meta.bin"), dtype=np.uint8, mode="r")
+        self.meta_offsets = _load(os.path.join(path, "meta_offsets.npy"))
+
+    def __len__(self) -> int:
+        return self.manifest["count"]
+
+    @staticmethod
+    def current_version(root: str) -> Optional[str]:
+        try:
+            with open(os.path.join(root, CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def open_current(cls, root: str) -> Optional["VectorSnapshot"]:
+        version = cls.current_version(root)
+        if not version or not os.path.exists(os.path.join(root, version, "manifest.json")):
+            return None
+        return cls(os.path.join(root, version))
+
+    @classmethod
+    def export(cls, root: str, embeddings: List[List[float]], texts: List[str], metadatas: List[dict],
+               dtype: str = "int8", keep_full_precision: bool = True, version: Optional[str] = None,
+               activate: bool = True) -> "VectorSnapshot":
+        """Writes a new snapshot version under root and, if activate, points CURRENT at it."""
+        if dtype not in ("int8", "float16"):
+            raise ValueError(f"Unsupported snapshot dtype: {dtype}")
+        if not texts:
+            raise ValueError("Cannot export an empty snapshot")
+
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+
+        if version is None:
+            digest = hashlib.sha1()
+            for text, meta in zip(texts, metadatas):
+                digest.update(meta.get("chunk_id", "").encode("utf-8"))
+                digest.update(text.encode("utf-8"))
+            version = digest.hexdigest()[:16]
+
+        final_path = os.path.join(root, version)
+        existing = os.path.join(final_path, "manifest.json")
+        if os.path.exists(existing):
+            with open(existing) as f:
+                manifest = json.load(f)
+            if manifest["dtype"] == dtype and manifest["full_precision"] == keep_full_precision:
+                # Same content is already on disk (possibly live); never rewrite it under readers
+                if activate:
+                    cls.activate(root, version)
+                return cls(final_path)
+
+        tmp_path = f"{final_path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        if dtype == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.round(matrix / scales[:, None]).astype(np.int8)
+            np.save(os.path.join(tmp_path, "scales.npy"), scales.astype(np.float32))
+        else:
+            quantized = matrix.astype(np.float16)
+        np.save(os.path.join(tmp_path, "vectors.npy"), quantized)
+        if keep_full_precision:
+            np.save(os.path.join(tmp_path, "vectors_f32.npy"), matrix)
+
+        text_offsets = _write_blob(os.path.join(tmp_path, "texts.bin"), [t.encode("utf-8") for t in texts])
+        meta_offsets = _write_blob(os.path.join(tmp_path, "meta.bin"), [json.dumps(m).encode("utf-8") for m in metadatas])
+        np.save(os.path.join(tmp_path, "text_offsets.npy"), text_offsets)
+        np.save(os.path.join(tmp_path, "meta_offsets.npy"), meta_offsets)
+
+        with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+            json.dump({
+                "version": version,
+                "count": len(texts),
+                "dim": int(matrix.shape[1]),
+                "dtype": dtype,
+                "full_precision": keep_full_precision,
+                "created_at": datetime.utcnow().isoformat(),
+            }, f)
+
+        shutil.rmtree(final_path, ignore_errors=True)
+        os.replace(tmp_path, final_path)
+        if activate:
+            cls.activate(root, version)
+        return cls(final_path)
+
+    @staticmethod
+    def activate(root: str, version: str):
+        """Atomically switches readers to the given version."""
+        tmp = os.path.join(root, f"{CURRENT_FILE}.tmp-{os.getpid()}")
+        with open(tmp, "w") as f:
+            f.write(version)
+        os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+    @staticmethod
+    def prune(root: str, keep: set):
+        """Removes snapshot versions not in keep; readers that still map them keep their pages."""
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name not in keep and os.path.isdir(path) and ".tmp-" not in name:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _document(self, row: int) -> Document:
+        text = bytes(self.texts[self.text_offsets[row]:self.text_offsets[row + 1]]).decode("utf-8")
+        meta = json.loads(bytes(self.meta[self.meta_offsets[row]:self.meta_offsets[row + 1]]).decode("utf-8"))
+        return Document(page_content=text, metadata=meta)
+
+    def _approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        """Cosine scores against the quantised matrix, computed in blocks to bound memory."""
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def search(self, query_vector: List[float], k: int = 3, rescore: bool = True, oversample: int = 4) -> List[Tuple[Document, float]]:
+        """Top-k chunks by cosine similarity, optionally re-ranked with the float32 vectors."""
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        scores = self._approximate_scores(query)
+        candidates = min(len(self), k * oversample if rescore and self.full_vectors is not None else k)
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+
+        if rescore and self.full_vectors is not None:
+            rows = np.sort(top)
+            exact = np.asarray(self.full_vectors[rows], dtype=np.float32) @ query
+            scores = dict(zip(rows.tolist(), exact.tolist()))
+        else:
+            scores = {int(row): float(scores[row]) for row in top}
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self._document(row), score) for row, score in ranked]
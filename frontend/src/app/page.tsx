@@ -170,6 +170,30 @@ export default function Home() {
         addDevLog(`ERROR: Ingestion failed - ${errorData.detail}`);
         throw new Error(errorData.detail || 'Ingestion failed');
       }
+      // Ingestion runs as a background job; poll its progress until it finishes
+      let job = await response.json();
+      addDevLog(`Ingest job ${job.job_id} queued.`);
+      while (!['completed', 'failed', 'cancelled'].includes(job.status)) {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        const statusResponse = await fetch(`http://localhost:8000/ingest/${job.job_id}`, {
+          headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!statusResponse.ok) {
+          const errorData = await statusResponse.json().catch(() => ({}));
+          addDevLog(`ERROR: Could not read ingest job status - ${errorData.detail || statusResponse.status}`);
+          throw new Error(errorData.detail || `Ingest status check failed (${statusResponse.status})`);
+        }
+        job = await statusResponse.json();
+        if (job.stage === 'embedding' && job.chunks_total) {
+          addDevLog(`Embedding ${job.chunks_embedded}/${job.chunks_total} chunks (ETA ${job.eta_seconds ?? '?'}s)`);
+        } else if (job.stage === 'parsing' && job.files_total) {
+          addDevLog(`Parsed ${job.files_parsed}/${job.files_total} files`);
+        }
+      }
+      if (job.status !== 'completed') {
+        addDevLog(`ERROR: Ingest job ${job.status}${job.error ? ` - ${job.error}` : ''}`);
+        throw new Error(job.error || `Ingestion ${job.status}`);
+      }
       addDevLog("Ingestion successful. Vector store updated with new playbook data.");
       alert('Documents ingested successfully!');
     } catch (err: any) {